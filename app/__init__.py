@@ -65,10 +65,9 @@ def create_app(config_class=Config):
 
         # Nova função que verifica se o usuário tem QUALQUER uma das permissões da lista
         def tem_alguma_permissao(lista_de_permissoes):
-            if not current_user.is_authenticated or not current_user.perfil:
+            if not current_user.is_authenticated:
                 return False
-            permissoes_do_usuario = {p.nome for p in current_user.perfil.permissoes}
-            return not permissoes_do_usuario.isdisjoint(lista_de_permissoes)
+            return not current_user.permissoes.isdisjoint(lista_de_permissoes)
 
         # Retorna as funções e a lista para os templates
         return dict(
@@ -81,7 +80,7 @@ def create_app(config_class=Config):
     @app.cli.command('seed')
     def seed_db():
         """Popula o banco de dados com permissões iniciais e um perfil de admin."""
-        from app.models import Permissao, Perfil
+        from app.models import Permissao, Perfil, invalidar_cache_permissoes
 
         permissoes = [
             'acessar_painel_admin', 'gerenciar_setores', 'gerenciar_colaboradores',
@@ -104,6 +103,29 @@ def create_app(config_class=Config):
 
         print("Banco de dados populado com permissões e perfil de Super Admin.")
         db.session.commit()
+        invalidar_cache_permissoes()
+
+    # Comandos de manutenção (flask busca ..., flask planos ..., flask contadores ..., flask outbox ..., flask anexos ...)
+    from app.busca import busca_cli
+    from app.planos import planos_cli
+    from app.contadores import contadores_cli
+    from app.email import outbox_cli, iniciar_worker_embutido
+    from app.anexos import anexos_cli
+    from app import previas  # adiciona `flask anexos previas`
+    app.cli.add_command(busca_cli)
+    app.cli.add_command(planos_cli)
+    app.cli.add_command(contadores_cli)
+    app.cli.add_command(outbox_cli)
+    app.cli.add_command(anexos_cli)
+    for ausente in previas.renderizadores_ausentes():
+        app.logger.warning(f"Prévias de anexos: falta {ausente}.")
+
+    # O worker embutido só sobe no primeiro request, para não rodar junto de `flask db upgrade` etc.
+    if app.config['OUTBOX_WORKER_EMBUTIDO']:
+        @app.before_request
+        def garantir_worker_outbox():
+            if 'outbox_worker' not in app.extensions:
+                iniciar_worker_embutido(app)
 
     # Importa e registra os Blueprints
     from app.routes import main_bp
@@ -0,0 +1,260 @@
+import hashlib
+import mimetypes
+import os
+import tempfile
+import click
+from flask import current_app, request, send_file
+from flask.cli import AppGroup
+from sqlalchemy import func
+from werkzeug.utils import secure_filename, send_file as enviar_arquivo
+from app import db
+from app.models import Anexo, ConteudoAnexo
+from app.armazenamento import obter_armazenamento, ajustar_referencias
+
+TAMANHO_BLOCO = 64 * 1024
+
+class AnexoRecusado(Exception):
+    """Upload fora dos limites configurados; a mensagem é mostrada ao usuário."""
+
+class ArquivoRecebido:
+    """Upload já gravado num arquivo temporário dentro da pasta de uploads."""
+
+    def __init__(self, nome_arquivo, caminho_temporario, tamanho, sha256, mime_type):
+        self.nome_arquivo = nome_arquivo
+        self.caminho_temporario = caminho_temporario
+        self.tamanho = tamanho
+        self.sha256 = sha256
+        self.mime_type = mime_type
+
+def _gravar_em_blocos(arquivo, destino, limite, mensagem_limite):
+    """Copia o stream do upload em blocos de TAMANHO_BLOCO calculando o SHA-256. Retorna (tamanho, hash)."""
+    sha256 = hashlib.sha256()
+    tamanho = 0
+    while True:
+        bloco = arquivo.stream.read(TAMANHO_BLOCO)
+        if not bloco:
+            break
+        tamanho += len(bloco)
+        if tamanho > limite:
+            raise AnexoRecusado(mensagem_limite)
+        sha256.update(bloco)
+        destino.write(bloco)
+    return tamanho, sha256.hexdigest()
+
+def descartar(recebidos):
+    for recebido in recebidos:
+        try:
+            os.remove(recebido.caminho_temporario)
+        except FileNotFoundError:
+            pass
+
+def receber_anexos(arquivos):
+    """
+    Grava os uploads em arquivos temporários, um bloco por vez, aplicando os limites
+    por arquivo (ANEXO_TAMANHO_MAXIMO) e por envio (ANEXOS_TAMANHO_MAXIMO_ENVIO).
+    Em caso de erro apaga o que já foi gravado e levanta AnexoRecusado.
+    """
+    config = current_app.config
+    pasta = config['UPLOAD_FOLDER']
+    restante = config['ANEXOS_TAMANHO_MAXIMO_ENVIO']
+    recebidos = []
+    try:
+        for arquivo in arquivos:
+            nome = secure_filename(arquivo.filename)
+            if config['ANEXO_TAMANHO_MAXIMO'] <= restante:
+                limite = config['ANEXO_TAMANHO_MAXIMO']
+                mensagem = f"O arquivo {nome} passa do limite de {limite // (1024 * 1024)} MB."
+            else:
+                limite = restante
+                mensagem = f"Os anexos passam do limite de {config['ANEXOS_TAMANHO_MAXIMO_ENVIO'] // (1024 * 1024)} MB por envio."
+            descritor, caminho = tempfile.mkstemp(prefix='.upload-', dir=pasta)
+            try:
+                with os.fdopen(descritor, 'wb') as destino:
+                    tamanho, sha256 = _gravar_em_blocos(arquivo, destino, limite, mensagem)
+            except BaseException:
+                os.remove(caminho)
+                raise
+            restante -= tamanho
+            mime_type = mimetypes.guess_type(nome)[0] or arquivo.mimetype or 'application/octet-stream'
+            recebidos.append(ArquivoRecebido(nome, caminho, tamanho, sha256, mime_type))
+    except BaseException:
+        descartar(recebidos)
+        raise
+    return recebidos
+
+def anexar(protocolo, recebidos):
+    """
+    Cria os Anexo do protocolo e soma as referências dos conteúdos, tudo em lote. O protocolo
+    já precisa ter id; os Anexo vão para o banco no próximo flush/commit. Os arquivos só entram
+    no armazenamento em guardar_anexos, depois do commit.
+    """
+    anexos = []
+    deltas = {}
+    for recebido in recebidos:
+        anexo = Anexo(
+            nome_arquivo=recebido.nome_arquivo,
+            # Nome lógico usado na URL de download; o conteúdo fica no armazenamento pelo hash
+            caminho_arquivo=f"{protocolo.id}_{recebido.nome_arquivo}",
+            tamanho=recebido.tamanho,
+            sha256=recebido.sha256,
+            mime_type=recebido.mime_type,
+            protocolo=protocolo
+        )
+        db.session.add(anexo)
+        anexos.append(anexo)
+        _, delta = deltas.get(recebido.sha256, (recebido.tamanho, 0))
+        deltas[recebido.sha256] = (recebido.tamanho, delta + 1)
+    ajustar_referencias(deltas)
+    return anexos
+
+def guardar_anexos(recebidos):
+    """
+    Chamar depois do commit: move os arquivos recebidos para o armazenamento por conteúdo (um
+    conteúdo repetido não ocupa disco de novo). Se o commit falhar, use descartar(recebidos).
+    """
+    armazenamento = obter_armazenamento()
+    for recebido in recebidos:
+        armazenamento.guardar(recebido.caminho_temporario, recebido.sha256)
+
+def anexo_pelo_nome(caminho_arquivo):
+    """Anexo da URL de download. O prefixo numérico do nome é o protocolo, o que deixa a busca usar o índice."""
+    query = Anexo.query.filter(Anexo.caminho_arquivo == caminho_arquivo)
+    prefixo = caminho_arquivo.split('_', 1)[0]
+    if prefixo.isdigit():
+        query = query.filter(Anexo.protocolo_id == int(prefixo))
+    return query.first()
+
+def caminho_do_anexo(anexo):
+    """Arquivo em disco do anexo: no armazenamento por conteúdo ou, se ainda não migrado, na pasta antiga."""
+    if anexo.sha256:
+        caminho = obter_armazenamento().caminho(anexo.sha256)
+        if os.path.exists(caminho):
+            return caminho
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], anexo.caminho_arquivo)
+
+def _url_interna(anexo, caminho):
+    """Caminho do X-Accel-Redirect: o armazenamento por conteúdo e a pasta antiga têm cada um sua location no nginx."""
+    config = current_app.config
+    if anexo.sha256 and caminho == obter_armazenamento().caminho(anexo.sha256):
+        prefixo, raiz = config['ANEXOS_OFFLOAD_PREFIXO_ARMAZENAMENTO'], config['ANEXOS_ARMAZENAMENTO_DIR']
+    else:
+        prefixo, raiz = config['ANEXOS_OFFLOAD_PREFIXO'], config['UPLOAD_FOLDER']
+    return prefixo.rstrip('/') + '/' + os.path.relpath(caminho, raiz).replace(os.sep, '/')
+
+def resposta_de_download(anexo):
+    """
+    Resposta do download com ETag (o SHA-256 do conteúdo) e Last-Modified, atendendo
+    If-None-Match/If-Modified-Since com 304 e Range com 206. Com ANEXOS_DOWNLOAD_OFFLOAD
+    o Flask só responde os cabeçalhos e o servidor da frente envia os bytes (e trata o Range).
+    """
+    caminho = caminho_do_anexo(anexo)
+    modo = current_app.config['ANEXOS_DOWNLOAD_OFFLOAD']
+    if not modo:
+        resposta = send_file(
+            caminho,
+            as_attachment=True,
+            download_name=anexo.nome_arquivo,
+            mimetype=anexo.mime_type,
+            etag=anexo.sha256 or True
+        )
+        resposta.cache_control.private = True
+        return resposta
+
+    # Com use_x_sendfile o werkzeug monta só os cabeçalhos, sem abrir o arquivo
+    resposta = enviar_arquivo(
+        caminho,
+        request.environ,
+        as_attachment=True,
+        download_name=anexo.nome_arquivo,
+        mimetype=anexo.mime_type,
+        etag=anexo.sha256 or True,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+        conditional=False
+    )
+    resposta.cache_control.private = True
+    # Sem o corpo, a resposta não pode virar 206: o Range fica por conta do proxy
+    resposta.headers.pop('Content-Length', None)
+    resposta.headers['Accept-Ranges'] = 'bytes'
+    resposta.make_conditional(request)
+    if resposta.status_code == 304:
+        resposta.headers.pop('X-Sendfile', None)
+    elif modo == 'x-accel-redirect':
+        del resposta.headers['X-Sendfile']
+        resposta.headers['X-Accel-Redirect'] = _url_interna(anexo, caminho)
+    return resposta
+
+def _hash_do_arquivo(caminho):
+    sha256 = hashlib.sha256()
+    tamanho = 0
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO), b''):
+            sha256.update(bloco)
+            tamanho += len(bloco)
+    return tamanho, sha256.hexdigest()
+
+anexos_cli = AppGroup('anexos', help='Manutenção do armazenamento de anexos.')
+
+@anexos_cli.command('migrar')
+@click.option('--lote', default=200, show_default=True, help='Anexos processados por commit.')
+def migrar(lote):
+    """Move os arquivos da pasta de uploads antiga para o armazenamento por conteúdo."""
+    armazenamento = obter_armazenamento()
+    pasta = current_app.config['UPLOAD_FOLDER']
+    migrados = ausentes = 0
+    ultimo_id = 0
+    while True:
+        anexos = Anexo.query.filter(Anexo.id > ultimo_id).order_by(Anexo.id).limit(lote).all()
+        if not anexos:
+            break
+        deltas = {}
+        mover = []
+        for anexo in anexos:
+            if anexo.sha256 and armazenamento.existe(anexo.sha256):
+                continue
+            antigo = os.path.join(pasta, anexo.caminho_arquivo)
+            if not os.path.isfile(antigo):
+                ausentes += 1
+                print(f"Arquivo não encontrado para o anexo {anexo.id}: {anexo.caminho_arquivo}")
+                continue
+            anexo.tamanho, anexo.sha256 = _hash_do_arquivo(antigo)
+            anexo.mime_type = anexo.mime_type or mimetypes.guess_type(anexo.nome_arquivo)[0] or 'application/octet-stream'
+            _, delta = deltas.get(anexo.sha256, (anexo.tamanho, 0))
+            deltas[anexo.sha256] = (anexo.tamanho, delta + 1)
+            mover.append((antigo, anexo.sha256))
+        ajustar_referencias(deltas)
+        db.session.commit()
+        # Só sai da pasta antiga depois do commit: se ele falhar, o anexo continua apontando para lá
+        for antigo, sha256 in mover:
+            armazenamento.guardar(antigo, sha256)
+        migrados += len(mover)
+        ultimo_id = anexos[-1].id
+    print(f"{migrados} anexo(s) migrado(s), {ausentes} sem arquivo.")
+
+@anexos_cli.command('coletar')
+@click.option('--apenas-verificar', is_flag=True, help='Só lista o que seria corrigido/removido.')
+def coletar(apenas_verificar):
+    """Recalcula as referências a partir da tabela Anexo e apaga os conteúdos sem nenhuma referência."""
+    armazenamento = obter_armazenamento()
+    reais = dict(db.session.query(Anexo.sha256, func.count(Anexo.id)).filter(Anexo.sha256.isnot(None)).group_by(Anexo.sha256).all())
+    corrigidos = removidos = 0
+    for conteudo in ConteudoAnexo.query.all():
+        referencias = reais.get(conteudo.sha256, 0)
+        if referencias == 0:
+            removidos += 1
+            if apenas_verificar:
+                continue
+            # Só apaga se ninguém referenciou o conteúdo desde a leitura; mesmo assim, rode fora do horário de uso
+            apagado = ConteudoAnexo.query.filter_by(
+                sha256=conteudo.sha256, referencias=conteudo.referencias
+            ).delete(synchronize_session=False)
+            db.session.commit()
+            if apagado:
+                armazenamento.remover(conteudo.sha256)
+        elif referencias != conteudo.referencias:
+            corrigidos += 1
+            print(f"{conteudo.sha256}: {conteudo.referencias} -> {referencias} referência(s)")
+            if not apenas_verificar:
+                conteudo.referencias = referencias
+                db.session.commit()
+    print(f"{corrigidos} contagem(ns) corrigida(s), {removidos} conteúdo(s) sem referência {'encontrado(s)' if apenas_verificar else 'removido(s)'}.")
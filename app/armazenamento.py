@@ -0,0 +1,90 @@
+import os
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import ConteudoAnexo
+
+class ArmazenamentoPorConteudo:
+    """
+    Guarda cada conteúdo uma única vez, pelo SHA-256, em diretórios de dois níveis
+    (ab/cd/abcd...) para nenhuma pasta ficar com milhares de arquivos.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def caminho(self, sha256):
+        return os.path.join(self.diretorio, sha256[:2], sha256[2:4], sha256)
+
+    def existe(self, sha256):
+        return os.path.exists(self.caminho(sha256))
+
+    def guardar(self, caminho_origem, sha256):
+        """Move o arquivo para o armazenamento; se o conteúdo já existe, só descarta a origem."""
+        destino = self.caminho(sha256)
+        if os.path.exists(destino):
+            os.remove(caminho_origem)
+            return destino
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        os.replace(caminho_origem, destino)
+        return destino
+
+    def remover(self, sha256):
+        """Apaga o conteúdo e os arquivos derivados dele (ex.: <hash>.miniatura.jpg)."""
+        caminho = self.caminho(sha256)
+        pasta = os.path.dirname(caminho)
+        if not os.path.isdir(pasta):
+            return
+        for nome in os.listdir(pasta):
+            if nome == sha256 or nome.startswith(sha256 + '.'):
+                try:
+                    os.remove(os.path.join(pasta, nome))
+                except FileNotFoundError:
+                    pass
+
+def obter_armazenamento():
+    return ArmazenamentoPorConteudo(current_app.config['ANEXOS_ARMAZENAMENTO_DIR'])
+
+def ajustar_referencias(deltas):
+    """
+    Soma os deltas ({sha256: (tamanho, delta)}) às referências dos conteúdos, criando a linha
+    na primeira referência. Tudo em lote e direto na conexão da sessão: não dispara flush do ORM.
+    """
+    tabela = ConteudoAnexo.__table__
+    conexao = db.session.connection()
+    pendentes = {sha256: valores for sha256, valores in deltas.items() if valores[1]}
+    for _ in range(2):
+        if not pendentes:
+            return
+        existentes = set(conexao.execute(
+            sa.select(tabela.c.sha256).where(tabela.c.sha256.in_(list(pendentes)))
+        ).scalars())
+        if existentes:
+            conexao.execute(
+                tabela.update().where(tabela.c.sha256 == sa.bindparam('conteudo'))
+                .values(referencias=tabela.c.referencias + sa.bindparam('delta')),
+                [{'conteudo': sha256, 'delta': pendentes[sha256][1]} for sha256 in existentes]
+            )
+        # Referência removida de conteúdo sem linha (anexo antigo) não tem o que ajustar
+        novos = {sha256: valores for sha256, valores in pendentes.items() if sha256 not in existentes and valores[1] > 0}
+        if not novos:
+            return
+        try:
+            with conexao.begin_nested():
+                conexao.execute(tabela.insert(), [
+                    {'sha256': sha256, 'tamanho': tamanho, 'referencias': delta} for sha256, (tamanho, delta) in novos.items()
+                ])
+            return
+        except IntegrityError:
+            pendentes = novos  # Mesmo conteúdo enviado em paralelo por outro request; agora a linha existe
+    raise RuntimeError(f"Não foi possível atualizar as referências de {', '.join(pendentes)}.")
+
+def liberar_anexos(anexos):
+    """Chamar antes de excluir os Anexo. Os arquivos só saem do disco no `flask anexos coletar`."""
+    deltas = {}
+    for anexo in anexos:
+        if anexo.sha256:
+            tamanho, delta = deltas.get(anexo.sha256, (anexo.tamanho, 0))
+            deltas[anexo.sha256] = (tamanho, delta - 1)
+    ajustar_referencias(deltas)
@@ -0,0 +1,166 @@
+import re
+import unicodedata
+import click
+import sqlalchemy as sa
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import or_
+from app import db
+from app.models import Protocolo, TermoBusca
+
+# Peso de cada campo no cálculo da relevância
+PESOS = {'numero_protocolo': 5, 'assunto': 3, 'descricao': 1}
+TAMANHO_MINIMO = 2
+MAX_TERMOS_CONSULTA = 8
+
+def normalizar(texto):
+    """Minúsculas e sem acentos, para que 'Análise' e 'analise' caiam no mesmo termo."""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+
+def tokenizar(texto):
+    termos = re.findall(r'\w+', normalizar(texto))
+    return [t[:64] for t in termos if len(t) >= TAMANHO_MINIMO]
+
+def termos_do_protocolo(protocolo):
+    """Retorna {termo: peso} para os campos pesquisáveis do protocolo."""
+    termos = {}
+    for campo, peso in PESOS.items():
+        for termo in tokenizar(getattr(protocolo, campo)):
+            termos[termo] = termos.get(termo, 0) + peso
+    # Permite achar '2025-000123' digitando só '123'
+    partes = (protocolo.numero_protocolo or '').split('-')
+    if len(partes) == 2 and partes[1].isdigit():
+        sequencial = str(int(partes[1]))
+        termos[sequencial] = termos.get(sequencial, 0) + PESOS['numero_protocolo']
+    return termos
+
+def _fim_da_faixa(prefixo):
+    """
+    Limite superior (exclusivo) dos termos que começam com `prefixo`, ou None. Os termos só têm
+    minúsculas sem acento, dígitos e '_', então basta avançar o último caractere quando ele
+    continua dentro de a-z ou 0-9 ('ab' -> 'ac').
+    """
+    ultimo = prefixo[-1]
+    if 'a' <= ultimo < 'z' or '0' <= ultimo < '9':
+        return prefixo[:-1] + chr(ord(ultimo) + 1)
+    return None
+
+class IndiceTermos:
+    """Índice invertido próprio (tabela TermoBusca). Funciona em qualquer banco, inclusive SQLite."""
+
+    def atualizar(self, protocolo):
+        if protocolo.id is None:
+            db.session.flush()
+        self.remover(protocolo.id)
+        linhas = [{'termo': termo, 'protocolo_id': protocolo.id, 'peso': peso}
+                  for termo, peso in termos_do_protocolo(protocolo).items()]
+        if linhas:
+            db.session.execute(sa.insert(TermoBusca.__table__), linhas)
+
+    def remover(self, protocolo_id):
+        db.session.execute(sa.delete(TermoBusca.__table__).where(TermoBusca.protocolo_id == protocolo_id))
+
+    def subconsulta(self, termo_busca):
+        """Subconsulta (protocolo_id, relevancia) com os protocolos que contêm todos os termos buscados."""
+        termos = list(dict.fromkeys(tokenizar(termo_busca)))[:MAX_TERMOS_CONSULTA]
+        if not termos:
+            return None
+        # Um agrupamento por termo (busca por prefixo no índice da chave primária),
+        # depois a interseção por protocolo_id somando os pesos
+        parciais = []
+        for i, termo in enumerate(termos):
+            # A faixa deixa o banco buscar direto no índice: o SQLite não usa índice num LIKE
+            # montado por concatenação. O LIKE continua valendo como filtro.
+            faixa = [TermoBusca.termo >= termo]
+            fim = _fim_da_faixa(termo)
+            if fim:
+                faixa.append(TermoBusca.termo < fim)
+            parciais.append(
+                sa.select(TermoBusca.protocolo_id, sa.func.sum(TermoBusca.peso).label('peso'))
+                .where(*faixa, TermoBusca.termo.startswith(termo, autoescape=True))
+                .group_by(TermoBusca.protocolo_id)
+                .subquery(f't{i}')
+            )
+        base = parciais[0]
+        consulta = sa.select(
+            base.c.protocolo_id,
+            sum((p.c.peso for p in parciais[1:]), base.c.peso).label('relevancia')
+        ).select_from(base)
+        for p in parciais[1:]:
+            consulta = consulta.join(p, p.c.protocolo_id == base.c.protocolo_id)
+        return consulta.subquery('busca')
+
+class IndiceFullTextSQLServer:
+    """
+    Usa o catálogo Full-Text do SQL Server sobre a tabela Protocolo.
+    O catálogo se mantém sozinho (change tracking automático), então atualizar/remover não fazem nada.
+    """
+
+    def atualizar(self, protocolo):
+        pass
+
+    def remover(self, protocolo_id):
+        pass
+
+    def subconsulta(self, termo_busca):
+        termos = list(dict.fromkeys(tokenizar(termo_busca)))[:MAX_TERMOS_CONSULTA]
+        if not termos:
+            return None
+        expressao = ' AND '.join(f'"{t}*"' for t in termos)
+        return sa.text(
+            "SELECT [KEY] AS protocolo_id, [RANK] AS relevancia "
+            "FROM CONTAINSTABLE(Protocolo, (numero_protocolo, assunto, descricao), :expressao)"
+        ).bindparams(expressao=expressao).columns(
+            sa.column('protocolo_id', sa.Integer), sa.column('relevancia', sa.Integer)
+        ).subquery('busca')
+
+BACKENDS = {'termos': IndiceTermos, 'fulltext': IndiceFullTextSQLServer}
+
+def obter_indice():
+    return BACKENDS[current_app.config['BUSCA_BACKEND']]()
+
+def indexar_protocolo(protocolo):
+    obter_indice().atualizar(protocolo)
+
+def remover_do_indice(protocolo_id):
+    obter_indice().remover(protocolo_id)
+
+def filtrar_por_busca(query, termo_busca):
+    """Aplica o filtro da caixa de busca do dashboard/exportação usando o índice."""
+    subconsulta = obter_indice().subconsulta(termo_busca)
+    if subconsulta is None:
+        # Termo curto demais para o índice (ex.: 1 caractere): mantém o comportamento antigo
+        termo = f"%{termo_busca}%"
+        return query.filter(or_(Protocolo.assunto.ilike(termo), Protocolo.descricao.ilike(termo), Protocolo.numero_protocolo.ilike(termo)))
+    return query.filter(Protocolo.id.in_(sa.select(subconsulta.c.protocolo_id)))
+
+def buscar_ranqueado(query, termo_busca, limite=20):
+    """Retorna até `limite` protocolos da consulta ordenados pela relevância da busca."""
+    subconsulta = obter_indice().subconsulta(termo_busca)
+    if subconsulta is None:
+        return []
+    return query.join(subconsulta, subconsulta.c.protocolo_id == Protocolo.id) \
+        .order_by(subconsulta.c.relevancia.desc(), Protocolo.data_criacao.desc()) \
+        .limit(limite).all()
+
+busca_cli = AppGroup('busca', help='Manutenção do índice de busca de protocolos.')
+
+@busca_cli.command('reindexar')
+@click.option('--lote', default=1000, show_default=True, help='Protocolos processados por commit.')
+def reindexar(lote):
+    """Reconstrói o índice de busca de todos os protocolos."""
+    indice = obter_indice()
+    total = 0
+    ultimo_id = 0
+    while True:
+        protocolos = Protocolo.query.filter(Protocolo.id > ultimo_id).order_by(Protocolo.id).limit(lote).all()
+        if not protocolos:
+            break
+        for protocolo in protocolos:
+            indice.atualizar(protocolo)
+        db.session.commit()
+        ultimo_id = protocolos[-1].id
+        total += len(protocolos)
+        print(f"{total} protocolos indexados...")
+    print(f"Índice de busca reconstruído ({total} protocolos).")
@@ -0,0 +1,128 @@
+import hashlib
+import os
+import threading
+from datetime import date
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+import sqlalchemy as sa
+from flask import current_app, request
+from sqlalchemy import func
+from app import db
+from app.models import Historico, ContadorProtocolo
+
+class CacheMemoria:
+    """LRU em memória, por processo."""
+
+    def __init__(self, max_itens):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is not None:
+                self._itens.move_to_end(chave)
+            return valor
+
+    def set(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+class CacheArquivos:
+    """
+    Cache em disco compartilhado por todos os processos da máquina (ex.: várias
+    instâncias do waitress atrás do IIS). Remove os arquivos menos acessados
+    quando passa de max_itens.
+    """
+
+    def __init__(self, diretorio, max_itens):
+        self.diretorio = diretorio
+        self.max_itens = max_itens
+        os.makedirs(diretorio, exist_ok=True)
+
+    def _caminho(self, chave):
+        return os.path.join(self.diretorio, hashlib.sha256(chave.encode('utf-8')).hexdigest())
+
+    def get(self, chave):
+        caminho = self._caminho(chave)
+        try:
+            with open(caminho, 'rb') as arquivo:
+                valor = arquivo.read()
+            os.utime(caminho)
+            return valor
+        except FileNotFoundError:
+            return None
+
+    def set(self, chave, valor):
+        caminho = self._caminho(chave)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(valor)
+        os.replace(temporario, caminho)
+        self._despejar()
+
+    def _despejar(self):
+        entradas = [e for e in os.scandir(self.diretorio) if e.is_file() and not e.name.endswith('.tmp')]
+        if len(entradas) <= self.max_itens:
+            return
+        entradas.sort(key=lambda e: e.stat().st_mtime)
+        for entrada in entradas[:len(entradas) - self.max_itens]:
+            try:
+                os.remove(entrada.path)
+            except FileNotFoundError:
+                pass
+
+def obter_backend():
+    app = current_app._get_current_object()
+    backend = app.extensions.get('cache_respostas')
+    if backend is None:
+        if app.config['RESPOSTAS_CACHE_BACKEND'] == 'arquivos':
+            backend = CacheArquivos(app.config['RESPOSTAS_CACHE_DIR'], app.config['RESPOSTAS_CACHE_MAX_ITENS'])
+        else:
+            backend = CacheMemoria(app.config['RESPOSTAS_CACHE_MAX_ITENS'])
+        app.extensions['cache_respostas'] = backend
+    return backend
+
+def marca_de_versao():
+    """
+    Muda sempre que algum protocolo é criado, tramitado ou excluído: toda criação e mudança
+    de status grava um Historico, e toda exclusão diminui a soma dos contadores.
+    """
+    soma_contadores = sa.select(func.coalesce(func.sum(ContadorProtocolo.total), 0)).scalar_subquery()
+    ultimo_historico, soma = db.session.query(func.max(Historico.id), soma_contadores).one()
+    return f"{ultimo_historico or 0}.{soma}"
+
+def resposta_versionada(view):
+    """
+    Cacheia o JSON da view por endpoint + parâmetros + marca de versão e responde
+    com ETag, devolvendo 304 quando o navegador já tem a versão atual.
+    """
+    @wraps(view)
+    def decorated_function(*args, **kwargs):
+        parametros = urlencode(sorted(request.args.items(multi=True)))
+        # A data entra na chave porque os relatórios usam janelas relativas a hoje
+        chave = f"{request.endpoint}?{parametros}@{marca_de_versao()}@{date.today().isoformat()}"
+        etag = hashlib.sha1(chave.encode('utf-8')).hexdigest()
+
+        if etag in request.if_none_match:
+            resposta = current_app.response_class(status=304)
+        else:
+            backend = obter_backend()
+            corpo = backend.get(chave)
+            if corpo is None:
+                resposta_view = current_app.make_response(view(*args, **kwargs))
+                if resposta_view.status_code != 200:
+                    return resposta_view
+                corpo = resposta_view.get_data()
+                backend.set(chave, corpo)
+            resposta = current_app.response_class(corpo, mimetype='application/json')
+
+        resposta.set_etag(etag)
+        resposta.headers['Cache-Control'] = 'private, no-cache'
+        return resposta
+    return decorated_function
@@ -0,0 +1,73 @@
+import sqlalchemy as sa
+from sqlalchemy import and_, or_, func
+from app import db
+from app.models import Protocolo
+from app.carregamento import com_perfil
+from app.paginacao import paginar_keyset, codificar_cursor
+
+STATUS_PENDENTES = ['Aberto', 'Em Análise', 'Pendente']
+SECOES = ('rascunhos', 'enviados', 'recebidos')
+ITENS_POR_SECAO = 25
+
+def _filtros_secoes(colaborador):
+    return {
+        'rascunhos': and_(
+            Protocolo.criado_por_id == colaborador.id,
+            Protocolo.status == 'Rascunho'
+        ),
+        'enviados': and_(
+            Protocolo.criado_por_id == colaborador.id,
+            Protocolo.status.in_(STATUS_PENDENTES)
+        ),
+        'recebidos': and_(
+            or_(
+                Protocolo.setor_destinatario_id == colaborador.setor_id,
+                Protocolo.colaborador_destinatario_id == colaborador.id
+            ),
+            Protocolo.status.in_(STATUS_PENDENTES)
+        ),
+    }
+
+def carregar_caixa(colaborador, limite=ITENS_POR_SECAO):
+    """
+    Primeira página de todas as seções de Meus Relatórios.
+
+    Um único SELECT sobre o UNION ALL das três seções numera as linhas por seção
+    (ROW_NUMBER) e traz o total de cada uma (COUNT OVER); depois os protocolos da
+    página são carregados de uma vez com o perfil 'list'.
+    """
+    ramos = [
+        sa.select(Protocolo.id, Protocolo.data_criacao, sa.literal(secao).label('secao')).where(filtro)
+        for secao, filtro in _filtros_secoes(colaborador).items()
+    ]
+    caixa = sa.union_all(*ramos).cte('caixa')
+    numerada = sa.select(
+        caixa.c.id,
+        caixa.c.secao,
+        func.row_number().over(
+            partition_by=caixa.c.secao,
+            order_by=(caixa.c.data_criacao.desc(), caixa.c.id.desc())
+        ).label('posicao'),
+        func.count().over(partition_by=caixa.c.secao).label('total')
+    ).subquery('numerada')
+    linhas = db.session.execute(
+        sa.select(numerada).where(numerada.c.posicao <= limite).order_by(numerada.c.secao, numerada.c.posicao)
+    ).all()
+
+    ids = {linha.id for linha in linhas}
+    protocolos = {p.id: p for p in com_perfil(Protocolo.query, 'list').filter(Protocolo.id.in_(ids))} if ids else {}
+
+    resultado = {secao: {'protocolos': [], 'total': 0, 'cursor': None} for secao in SECOES}
+    for linha in linhas:
+        secao = resultado[linha.secao]
+        secao['protocolos'].append(protocolos[linha.id])
+        secao['total'] = linha.total
+    for secao in resultado.values():
+        if secao['total'] > len(secao['protocolos']):
+            secao['cursor'] = codificar_cursor(secao['protocolos'][-1], 'next')
+    return resultado
+
+def pagina_da_secao(colaborador, secao, cursor, limite=ITENS_POR_SECAO):
+    """Próxima página de uma seção, por keyset a partir do cursor recebido."""
+    query = com_perfil(Protocolo.query, 'list').filter(_filtros_secoes(colaborador)[secao])
+    return paginar_keyset(query, limite, cursor)
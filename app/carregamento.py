@@ -0,0 +1,37 @@
+from sqlalchemy.orm import joinedload, selectinload
+from app.models import Protocolo, Historico
+
+# Perfis de carregamento das listagens de protocolo. Cada perfil traz junto tudo o que
+# o template correspondente lê por linha, para que a página rode um número fixo de consultas
+# em vez de um SELECT preguiçoso por protocolo. As relações muitos-para-um vão no mesmo
+# SELECT (joinedload); coleções vêm em uma consulta extra cada (selectinload).
+# Montados sob demanda porque os backrefs (criado_por, setor_destinatario...) só existem
+# depois que os mappers são configurados.
+PERFIS = {
+    # dashboard.html e meus_relatorios.html
+    'list': lambda: (
+        joinedload(Protocolo.modelo_usado),
+        joinedload(Protocolo.criado_por),
+        joinedload(Protocolo.setor_destinatario),
+    ),
+    # _kanban_cards.html
+    'kanban': lambda: (
+        joinedload(Protocolo.setor_destinatario),
+    ),
+    # protocolo_detalhe.html
+    'detail': lambda: (
+        joinedload(Protocolo.modelo_usado),
+        joinedload(Protocolo.criado_por),
+        joinedload(Protocolo.setor_destinatario),
+        joinedload(Protocolo.colaborador_destinatario),
+        selectinload(Protocolo.anexos),
+        selectinload(Protocolo.historico).joinedload(Historico.colaborador),
+    ),
+}
+
+def opcoes_carregamento(perfil):
+    return PERFIS[perfil]()
+
+def com_perfil(query, perfil):
+    """Aplica à consulta as opções de carregamento do perfil ('list', 'kanban' ou 'detail')."""
+    return query.options(*opcoes_carregamento(perfil))
@@ -0,0 +1,148 @@
+from datetime import date, datetime, time, timedelta
+import sqlalchemy as sa
+from flask.cli import AppGroup
+import click
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Protocolo, ContadorProtocolo, ResumoDiarioProtocolo
+
+# Os contadores (status x setor x modelo) e o resumo diário (dia x status x setor x modelo)
+# são ajustados na mesma transação que altera o protocolo, então os gráficos leem poucas
+# linhas em vez de agrupar a tabela Protocolo.
+
+def chave_contador(protocolo):
+    """(status, setor_id, modelo_id, dia de criação) do protocolo."""
+    if protocolo.id is None:
+        db.session.flush()  # data_criacao vem do default do banco
+    dia = protocolo.data_criacao.date() if protocolo.data_criacao else None
+    return (protocolo.status, protocolo.setor_destinatario_id, protocolo.modelo_usado_id or 0, dia)
+
+def _incrementar(tabela, chave, delta):
+    """UPDATE total = total + delta na linha da chave, criando a linha se ela ainda não existir."""
+    filtro = sa.and_(*(tabela.c[coluna] == valor for coluna, valor in chave.items()))
+    for _ in range(2):
+        if db.session.execute(tabela.update().where(filtro).values(total=tabela.c.total + delta)).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(tabela.insert().values(total=delta, **chave))
+            return
+        except IntegrityError:
+            pass  # Outro request criou a linha ao mesmo tempo; o UPDATE agora encontra
+    raise RuntimeError(f"Não foi possível atualizar {tabela.name} {chave}.")
+
+def _incrementar_contador(chave, delta):
+    status, setor_id, modelo_id = chave[:3]
+    _incrementar(ContadorProtocolo.__table__, {'status': status, 'setor_id': setor_id, 'modelo_id': modelo_id}, delta)
+
+def _incrementar_resumo(chave, delta):
+    status, setor_id, modelo_id, dia = chave
+    _incrementar(ResumoDiarioProtocolo.__table__,
+                 {'dia': dia, 'status': status, 'setor_id': setor_id, 'modelo_id': modelo_id}, delta)
+
+def mover_contador(antes, depois):
+    """Tira 1 da combinação `antes` e soma 1 em `depois` (qualquer uma pode ser None)."""
+    if antes == depois:
+        return
+    if antes is None or depois is None or antes[:3] != depois[:3]:
+        if antes is not None:
+            _incrementar_contador(antes, -1)
+        if depois is not None:
+            _incrementar_contador(depois, 1)
+    if antes is not None and antes[3] is not None:
+        _incrementar_resumo(antes, -1)
+    if depois is not None and depois[3] is not None:
+        _incrementar_resumo(depois, 1)
+
+def registrar_criacao(protocolo):
+    mover_contador(None, chave_contador(protocolo))
+
+def registrar_exclusao(protocolo):
+    mover_contador(chave_contador(protocolo), None)
+
+def _expressao_dia(coluna):
+    # CAST(... AS DATE) no SQL Server; no SQLite o CAST vira número, então usa date()
+    if db.engine.dialect.name == 'sqlite':
+        return func.date(coluna)
+    return sa.cast(coluna, sa.Date)
+
+def totais_reais():
+    """{(status, setor_id, modelo_id): total} calculado direto da tabela Protocolo."""
+    modelo = func.coalesce(Protocolo.modelo_usado_id, 0)
+    linhas = db.session.query(
+        Protocolo.status, Protocolo.setor_destinatario_id, modelo, func.count(Protocolo.id)
+    ).group_by(Protocolo.status, Protocolo.setor_destinatario_id, modelo).all()
+    return {(status, setor_id, modelo_id): total for status, setor_id, modelo_id, total in linhas}
+
+contadores_cli = AppGroup('contadores', help='Manutenção dos contadores dos relatórios.')
+
+@contadores_cli.command('reconciliar')
+@click.option('--apenas-verificar', is_flag=True, help='Só lista as diferenças, sem corrigir.')
+def reconciliar(apenas_verificar):
+    """Compara os contadores com a tabela Protocolo e corrige as divergências."""
+    reais = totais_reais()
+    gravados = {
+        (c.status, c.setor_id, c.modelo_id): c.total
+        for c in ContadorProtocolo.query.all()
+    }
+
+    diferencas = {
+        chave: reais.get(chave, 0) - gravados.get(chave, 0)
+        for chave in set(reais) | set(gravados)
+        if reais.get(chave, 0) != gravados.get(chave, 0)
+    }
+    for (status, setor_id, modelo_id), delta in sorted(diferencas.items(), key=str):
+        print(f"status={status!r} setor={setor_id} modelo={modelo_id}: {gravados.get((status, setor_id, modelo_id), 0)} -> {reais.get((status, setor_id, modelo_id), 0)}")
+
+    if not diferencas:
+        print("Contadores conferem com a tabela Protocolo.")
+        return
+    if apenas_verificar:
+        print(f"{len(diferencas)} contador(es) divergente(s).")
+        raise SystemExit(1)
+
+    # Protocolos alterados durante a contagem podem gerar nova divergência; rode fora do horário de uso
+    for chave, delta in diferencas.items():
+        _incrementar_contador(chave, delta)
+    db.session.commit()
+    print(f"{len(diferencas)} contador(es) corrigido(s).")
+
+@contadores_cli.command('backfill-resumo')
+@click.option('--inicio', type=click.DateTime(formats=['%Y-%m-%d']), help='Primeiro dia (padrão: o protocolo mais antigo).')
+@click.option('--fim', type=click.DateTime(formats=['%Y-%m-%d']), help='Último dia (padrão: hoje).')
+def backfill_resumo(inicio, fim):
+    """Recalcula o resumo diário a partir da tabela Protocolo para o período informado."""
+    if inicio is None:
+        mais_antigo = db.session.query(func.min(Protocolo.data_criacao)).scalar()
+        if mais_antigo is None:
+            print("Nenhum protocolo encontrado.")
+            return
+        inicio = mais_antigo
+    inicio = inicio.date()
+    fim = fim.date() if fim else date.today()
+
+    tabela = ResumoDiarioProtocolo.__table__
+    dia = _expressao_dia(Protocolo.data_criacao)
+    modelo = func.coalesce(Protocolo.modelo_usado_id, 0)
+
+    # Um mês por transação para não segurar locks na tabela inteira
+    atual = inicio
+    while atual <= fim:
+        proximo = min(date(atual.year + atual.month // 12, atual.month % 12 + 1, 1), fim + timedelta(days=1))
+        db.session.execute(tabela.delete().where(tabela.c.dia >= atual, tabela.c.dia < proximo))
+        linhas = db.session.query(
+            dia, Protocolo.status, Protocolo.setor_destinatario_id, modelo, func.count(Protocolo.id)
+        ).filter(
+            Protocolo.data_criacao >= datetime.combine(atual, time.min),
+            Protocolo.data_criacao < datetime.combine(proximo, time.min)
+        ).group_by(dia, Protocolo.status, Protocolo.setor_destinatario_id, modelo).all()
+        if linhas:
+            db.session.execute(tabela.insert(), [
+                {'dia': date.fromisoformat(str(d)[:10]), 'status': status, 'setor_id': setor_id, 'modelo_id': modelo_id, 'total': total}
+                for d, status, setor_id, modelo_id, total in linhas
+            ])
+        db.session.commit()
+        print(f"{atual:%Y-%m}: {len(linhas)} linha(s) de resumo.")
+        atual = proximo
+    print("Resumo diário recalculado.")
@@ -1,29 +1,290 @@
-from threading import Thread
+import json
+import os
+import socket
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
 from flask import current_app, render_template
+from flask.cli import AppGroup
 from flask_mail import Message
-from . import mail
+from sqlalchemy import func
+from . import db, mail
+from .models import EmailPendente, NotificacaoPendente, Colaborador
 
-def send_async_email(app, msg):
-    """Função que roda em uma thread para enviar o email."""
-    with app.app_context():
-        mail.send(msg)
+# Os emails não são mais enviados na hora por uma thread própria: send_email grava a
+# mensagem já renderizada na tabela EmailPendente e os workers (flask outbox run, ou o
+# worker embutido nos processos web) enviam em lotes reaproveitando a conexão SMTP.
+# Para testar localmente: python -m aiosmtpd -n -l localhost:8025 e MAIL_SERVER=localhost, MAIL_PORT=8025.
 
 def send_email(subject, recipients, template, **kwargs):
-    """Função principal para preparar e disparar o envio de email em segundo plano."""
-    # Pega a instância atual da aplicação
-    app = current_app._get_current_object()
+    """
+    Coloca o email na fila de saída. A mensagem entra na sessão atual, então é gravada
+    no mesmo commit da operação que a gerou (e descartada se ela for desfeita).
+    """
+    email = EmailPendente(
+        assunto=subject,
+        destinatarios=','.join(recipients),
+        corpo_html=render_template(template + '.html', **kwargs)
+    )
+    db.session.add(email)
+    return email
+
+ASSUNTOS = {
+    'novo_protocolo': "Novo Protocolo Recebido: {numero}",
+    'status_update': "Atualização no Protocolo {numero}",
+}
+
+def _dados_do_evento(protocolo, contexto):
+    """O que o resumo mostra de cada evento, guardado como texto para não depender do estado futuro do protocolo."""
+    dados = {'numero': protocolo.numero_protocolo, 'assunto': protocolo.assunto, 'descricao': protocolo.descricao}
+    if contexto.get('remetente') is not None:
+        dados['remetente'] = contexto['remetente'].nome
+    for campo in ('novo_status', 'despacho', 'autor_despacho'):
+        if campo in contexto:
+            dados[campo] = contexto[campo]
+    return dados
+
+def notificar(colaborador, tipo, protocolo, **contexto):
+    """
+    Avisa o colaborador sobre um evento do protocolo. Com intervalo_resumo = 0 o email sai
+    na hora com o template do evento (email/<tipo>); senão o evento fica guardado para o
+    próximo resumo. `contexto` são as variáveis do template do evento.
+    """
+    if not colaborador.intervalo_resumo:
+        return send_email(
+            subject=ASSUNTOS[tipo].format(numero=protocolo.numero_protocolo),
+            recipients=[colaborador.email],
+            template=f'email/{tipo}',
+            protocolo=protocolo,
+            **contexto
+        )
+    db.session.add(NotificacaoPendente(
+        colaborador_id=colaborador.id,
+        protocolo_id=protocolo.id,
+        tipo=tipo,
+        dados=json.dumps(_dados_do_evento(protocolo, contexto), ensure_ascii=False)
+    ))
+
+def enviar_resumos():
+    """
+    Junta as notificações pendentes de cada colaborador cujo intervalo já venceu em um
+    único email (uma renderização do template email/resumo_notificacoes com todos os
+    eventos). Retorna quantos resumos foram colocados na fila.
+    """
+    agora = datetime.now()
+    pendentes = db.session.query(
+        NotificacaoPendente.colaborador_id, func.min(NotificacaoPendente.data_criacao)
+    ).group_by(NotificacaoPendente.colaborador_id).all()
+    if not pendentes:
+        return 0
+    colaboradores = {c.id: c for c in Colaborador.query.filter(Colaborador.id.in_([cid for cid, _ in pendentes]))}
 
-    # Cria a mensagem de email
+    gerados = 0
+    for colaborador_id, mais_antiga in pendentes:
+        colaborador = colaboradores[colaborador_id]
+        if mais_antiga > agora - timedelta(minutes=colaborador.intervalo_resumo):
+            continue
+
+        notificacoes = NotificacaoPendente.query.filter(
+            NotificacaoPendente.colaborador_id == colaborador_id,
+            NotificacaoPendente.data_criacao <= agora
+        ).order_by(NotificacaoPendente.data_criacao, NotificacaoPendente.id).all()
+        ids = [n.id for n in notificacoes]
+        # Se outro worker apagou antes, ele é quem envia este resumo
+        if NotificacaoPendente.query.filter(NotificacaoPendente.id.in_(ids)).delete(synchronize_session=False) != len(ids):
+            db.session.rollback()
+            continue
+
+        eventos = [
+            dict(json.loads(n.dados), tipo=n.tipo, protocolo_id=n.protocolo_id, data=n.data_criacao)
+            for n in notificacoes
+        ]
+        send_email(
+            subject=f"Resumo de notificações do Sistema de Protocolo ({len(eventos)})",
+            recipients=[colaborador.email],
+            template='email/resumo_notificacoes',
+            destinatario=colaborador,
+            eventos=eventos
+        )
+        db.session.commit()
+        gerados += 1
+    return gerados
+
+def processar_resumos(app):
+    with app.app_context():
+        try:
+            return enviar_resumos()
+        finally:
+            db.session.remove()
+
+def _montar_mensagem(app, email):
     msg = Message(
-        subject,
+        email.assunto,
         sender=f"Sistema de Protocolo <{app.config['MAIL_USERNAME']}>",
-        recipients=recipients
+        recipients=email.destinatarios.split(',')
     )
+    msg.html = email.corpo_html
+    return msg
+
+def _reservar_lote(app, tamanho):
+    """
+    Marca até `tamanho` emails vencidos como 'enviando' para este worker. A reserva é um
+    UPDATE condicional, então dois workers (ou dois processos) nunca pegam o mesmo email;
+    se o worker morrer no meio, a reserva expira e o email volta para a fila.
+    """
+    agora = datetime.now()
+    token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:12]}"
+    ids = [id_ for (id_,) in db.session.query(EmailPendente.id).filter(
+        EmailPendente.status.in_(['pendente', 'enviando']),
+        EmailPendente.proxima_tentativa <= agora
+    ).order_by(EmailPendente.proxima_tentativa, EmailPendente.id).limit(tamanho).all()]
+    if not ids:
+        return []
+
+    EmailPendente.query.filter(
+        EmailPendente.id.in_(ids),
+        EmailPendente.status.in_(['pendente', 'enviando']),
+        EmailPendente.proxima_tentativa <= agora
+    ).update({
+        'status': 'enviando',
+        'reservado_por': token,
+        'tentativas': EmailPendente.tentativas + 1,
+        'proxima_tentativa': agora + timedelta(seconds=app.config['OUTBOX_RESERVA_SEGUNDOS'])
+    }, synchronize_session=False)
+    db.session.commit()
+    return EmailPendente.query.filter_by(reservado_por=token, status='enviando').order_by(EmailPendente.id).all()
+
+def _registrar_falha(app, email, erro):
+    email.ultimo_erro = f"{type(erro).__name__}: {erro}"[:4000]
+    email.reservado_por = None
+    if email.tentativas >= app.config['OUTBOX_MAX_TENTATIVAS']:
+        email.status = 'falhou'
+        return
+    # Backoff exponencial: base, 2x base, 4x base... limitado a OUTBOX_BACKOFF_MAXIMO
+    espera = min(app.config['OUTBOX_BACKOFF_BASE'] * 2 ** (email.tentativas - 1), app.config['OUTBOX_BACKOFF_MAXIMO'])
+    email.status = 'pendente'
+    email.proxima_tentativa = datetime.now() + timedelta(seconds=espera)
+
+def processar_lote(app, tamanho=None):
+    """Reserva um lote e envia tudo por uma única conexão SMTP. Retorna quantos emails foram processados."""
+    with app.app_context():
+        try:
+            lote = _reservar_lote(app, tamanho or app.config['OUTBOX_LOTE'])
+            if not lote:
+                return 0
+
+            conexao = None
+            try:
+                for email in lote:
+                    try:
+                        if conexao is None:
+                            conexao = mail.connect()
+                            conexao.__enter__()
+                        conexao.send(_montar_mensagem(app, email))
+                    except Exception as erro:
+                        _registrar_falha(app, email, erro)
+                        # A conexão pode ter ficado inutilizável; abre outra para o próximo email
+                        if conexao is not None:
+                            try:
+                                conexao.__exit__(None, None, None)
+                            except Exception:
+                                pass
+                            conexao = None
+                    else:
+                        email.status = 'enviado'
+                        email.reservado_por = None
+                        email.ultimo_erro = None
+                        email.data_envio = datetime.now()
+                    db.session.commit()
+            finally:
+                if conexao is not None:
+                    conexao.__exit__(None, None, None)
+            return len(lote)
+        finally:
+            db.session.remove()
+
+def executar_workers(app, workers, tamanho_lote, intervalo, parar=None):
+    """
+    Laço principal dos workers: até `workers` lotes em paralelo (cada um com sua conexão
+    SMTP) enquanto houver fila; quando ela esvazia, espera `intervalo` segundos.
+    """
+    parar = parar or threading.Event()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox') as executor:
+        while not parar.is_set():
+            try:
+                processar_resumos(app)
+                processados = sum(executor.map(lambda _: processar_lote(app, tamanho_lote), range(workers)))
+            except Exception:
+                app.logger.exception("Erro ao processar a fila de emails.")
+                processados = 0
+            if not processados:
+                parar.wait(intervalo)
+
+_lock_worker_embutido = threading.Lock()
+
+def iniciar_worker_embutido(app):
+    """Sobe (uma vez por processo) o worker da fila em segundo plano, para quem não roda `flask outbox run`."""
+    with _lock_worker_embutido:
+        if app.extensions.get('outbox_worker'):
+            return
+        thread = threading.Thread(
+            target=executar_workers,
+            args=(app, app.config['OUTBOX_WORKERS'], app.config['OUTBOX_LOTE'], app.config['OUTBOX_INTERVALO']),
+            name='outbox-worker',
+            daemon=True
+        )
+        thread.start()
+        app.extensions['outbox_worker'] = thread
+
+outbox_cli = AppGroup('outbox', help='Fila de saída de emails.')
+
+@outbox_cli.command('run')
+@click.option('--workers', type=int, help='Lotes enviados em paralelo (padrão: OUTBOX_WORKERS).')
+@click.option('--lote', type=int, help='Emails por conexão SMTP (padrão: OUTBOX_LOTE).')
+@click.option('--uma-vez', is_flag=True, help='Esvazia a fila atual e sai, em vez de ficar aguardando.')
+def run(workers, lote, uma_vez):
+    """Processa a fila de emails."""
+    app = current_app._get_current_object()
+    workers = workers or app.config['OUTBOX_WORKERS']
+    lote = lote or app.config['OUTBOX_LOTE']
+    if uma_vez:
+        processar_resumos(app)
+        total = 0
+        while True:
+            processados = processar_lote(app, lote)
+            if not processados:
+                break
+            total += processados
+        print(f"{total} email(s) processado(s).")
+        return
+
+    print(f"Processando a fila de emails com {workers} worker(s). Ctrl+C para sair.")
+    try:
+        executar_workers(app, workers, lote, app.config['OUTBOX_INTERVALO'])
+    except KeyboardInterrupt:
+        pass
+
+@outbox_cli.command('status')
+def status():
+    """Mostra quantos emails há em cada situação."""
+    linhas = db.session.query(EmailPendente.status, func.count(EmailPendente.id)).group_by(EmailPendente.status).all()
+    if not linhas:
+        print("Fila de emails vazia.")
+    for situacao, total in sorted(linhas):
+        print(f"{situacao:<10} {total}")
 
-    # Renderiza o corpo do email a partir de um template HTML
-    msg.html = render_template(template + '.html', **kwargs)
+@outbox_cli.command('reenviar')
+def reenviar():
+    """Devolve para a fila os emails que esgotaram as tentativas."""
+    total = EmailPendente.query.filter_by(status='falhou').update({
+        'status': 'pendente', 'tentativas': 0, 'proxima_tentativa': datetime.now()
+    }, synchronize_session=False)
+    db.session.commit()
+    print(f"{total} email(s) devolvido(s) para a fila.")
 
-    # Cria e inicia a thread para enviar o email de forma assíncrona
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
\ No newline at end of file
+@outbox_cli.command('resumos')
+def resumos():
+    """Coloca na fila os resumos de notificação que já venceram."""
+    print(f"{enviar_resumos()} resumo(s) de notificação gerado(s).")
@@ -0,0 +1,316 @@
+import csv
+import io
+import json
+import re
+import tempfile
+import zipfile
+import zlib
+from flask import current_app, render_template, request
+from openpyxl import Workbook
+from sqlalchemy import Text, select, type_coerce
+from sqlalchemy.orm import aliased
+from werkzeug.utils import secure_filename
+from app import db
+from app.models import Protocolo, Colaborador, Setor, ProtocoloModelo, CampoModelo, Historico
+from app.pdf import versao_do_protocolo, obter_servico_pdf
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Sem pyarrow só a exportação em Parquet fica indisponível
+    pa = None
+
+TAMANHO_BLOCO = 64 * 1024
+
+class SaidaEmStream(io.RawIOBase):
+    """
+    Destino de escrita que só acumula o que foi escrito até o próximo `retirar()`.
+    Sem seek/tell, o zipfile grava cada entrada com data descriptor e nunca volta no arquivo,
+    então o ZIP pode ir para a resposta HTTP enquanto é montado.
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def retirar(self):
+        dados = b''.join(self._partes)
+        self._partes = []
+        return dados
+
+def _nome_no_zip(protocolo):
+    return secure_filename(f"protocolo_{protocolo.numero_protocolo}.pdf") or f"protocolo_{protocolo.id}.pdf"
+
+def _submeter(servico, protocolo_id):
+    """Renderiza o HTML (só quando o PDF não está no cache) e coloca o protocolo no pool."""
+    protocolo = Protocolo.query.get(protocolo_id)
+    versao = versao_do_protocolo(protocolo)
+    if servico.cache.get(protocolo.id, versao):
+        html = None
+    else:
+        html = render_template('pdf/protocolo_pdf.html', protocolo=protocolo)
+    return servico.submeter(protocolo.id, versao, html, request.url_root), _nome_no_zip(protocolo)
+
+def zip_de_pdfs(protocolo_ids):
+    """
+    Gera os pedaços de um ZIP com o PDF de cada protocolo. Os PDFs são renderizados no
+    pool do ServicoPDF, com no máximo EXPORTACAO_PDF_JANELA jobs em aberto, e cada um entra
+    no ZIP assim que fica pronto; em memória fica só o bloco sendo copiado. Protocolos que
+    falharem são listados em ERROS.txt no fim do arquivo.
+    """
+    servico = obter_servico_pdf()
+    janela = current_app.config['EXPORTACAO_PDF_JANELA']
+    saida = SaidaEmStream()
+    restantes = iter(protocolo_ids)
+    em_aberto = {}
+    erros = []
+
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        while True:
+            for protocolo_id in restantes:
+                job_id, nome = _submeter(servico, protocolo_id)
+                em_aberto[job_id] = nome
+                if len(em_aberto) >= janela:
+                    break
+            if not em_aberto:
+                break
+
+            job_id, caminho = next(servico.em_ordem_de_conclusao(em_aberto))
+            nome = em_aberto.pop(job_id)
+            if caminho is None:
+                erros.append(f"{nome}: {servico.status(job_id)[1] or 'PDF não gerado.'}")
+                continue
+            with open(caminho, 'rb') as pdf, arquivo_zip.open(nome, 'w') as entrada:
+                for bloco in iter(lambda: pdf.read(TAMANHO_BLOCO), b''):
+                    entrada.write(bloco)
+                    yield saida.retirar()
+
+        if erros:
+            arquivo_zip.writestr('ERROS.txt', '\n'.join(erros) + '\n')
+    yield saida.retirar()
+
+def _campos_exportaveis():
+    """Campo exportável -> (tipo, coluna, JOIN que a coluna exige: (alvo, condição, externo) ou None)."""
+    criador = aliased(Colaborador, name='criador')
+    destinatario = aliased(Colaborador, name='destinatario')
+    return {
+        'id': ('inteiro', Protocolo.id, None),
+        'numero_protocolo': ('texto', Protocolo.numero_protocolo, None),
+        'status': ('texto', Protocolo.status, None),
+        'assunto': ('texto', Protocolo.assunto, None),
+        'descricao': ('texto', Protocolo.descricao, None),
+        'data_criacao': ('data_hora', Protocolo.data_criacao, None),
+        'criado_por': ('texto', criador.nome, (criador, criador.id == Protocolo.criado_por_id, False)),
+        'setor_destinatario': ('texto', Setor.nome, (Setor, Setor.id == Protocolo.setor_destinatario_id, False)),
+        'colaborador_destinatario': ('texto', destinatario.nome, (destinatario, destinatario.id == Protocolo.colaborador_destinatario_id, True)),
+        'modelo': ('texto', ProtocoloModelo.nome, (ProtocoloModelo, ProtocoloModelo.id == Protocolo.modelo_usado_id, True)),
+    }
+
+CAMPOS_EXPORTACAO = [
+    'id', 'numero_protocolo', 'status', 'assunto', 'descricao', 'data_criacao',
+    'criado_por', 'setor_destinatario', 'colaborador_destinatario', 'modelo'
+]
+# Sem `fields=`, as mesmas colunas da planilha do Excel
+CAMPOS_PADRAO = ['numero_protocolo', 'status', 'assunto', 'criado_por', 'data_criacao', 'setor_destinatario', 'colaborador_destinatario']
+
+def campos_pedidos(valor):
+    """Lista de campos do parâmetro `fields` (separados por vírgula). ValueError se algum não existir."""
+    if not valor:
+        return list(CAMPOS_PADRAO)
+    campos = [campo.strip() for campo in valor.split(',') if campo.strip()]
+    desconhecidos = [campo for campo in campos if campo not in CAMPOS_EXPORTACAO]
+    if desconhecidos or not campos:
+        raise ValueError(f"Campos inválidos: {', '.join(desconhecidos)}. Disponíveis: {', '.join(CAMPOS_EXPORTACAO)}.")
+    return list(dict.fromkeys(campos))
+
+def projetar_protocolos(query, campos):
+    """
+    Só as colunas `campos` da consulta, com apenas os JOINs que elas pedem, mais recentes
+    primeiro e lidas do banco em lotes de EXPORTACAO_LOTE linhas.
+    """
+    disponiveis = _campos_exportaveis()
+    for campo in campos:
+        juncao = disponiveis[campo][2]
+        if juncao:
+            alvo, condicao, externo = juncao
+            query = query.outerjoin(alvo, condicao) if externo else query.join(alvo, condicao)
+    return query.with_entities(*(disponiveis[campo][1] for campo in campos)) \
+        .order_by(Protocolo.data_criacao.desc()) \
+        .yield_per(current_app.config['EXPORTACAO_LOTE'])
+
+def _em_lotes(linhas, tamanho):
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def csv_de_protocolos(query, campos, comprimir=False):
+    """Gera o CSV (UTF-8, com cabeçalho) em pedaços de EXPORTACAO_LOTE linhas, opcionalmente em gzip."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if comprimir else None  # wbits=31: formato gzip
+    texto = io.StringIO()
+    escritor = csv.writer(texto)
+    escritor.writerow(campos)
+    for lote in _em_lotes(projetar_protocolos(query, campos), current_app.config['EXPORTACAO_LOTE']):
+        escritor.writerows(lote)
+        dados = texto.getvalue().encode('utf-8')
+        texto.seek(0)
+        texto.truncate()
+        yield compressor.compress(dados) if compressor else dados
+    dados = texto.getvalue().encode('utf-8')
+    yield compressor.compress(dados) + compressor.flush() if compressor else dados
+
+def suporta_parquet():
+    return pa is not None
+
+def parquet_de_protocolos(query, campos):
+    """Gera o arquivo Parquet em pedaços, um row group a cada EXPORTACAO_LOTE linhas."""
+    tipos = {'inteiro': pa.int64(), 'texto': pa.string(), 'data_hora': pa.timestamp('us')}
+    disponiveis = _campos_exportaveis()
+    esquema = pa.schema([(campo, tipos[disponiveis[campo][0]]) for campo in campos])
+    saida = SaidaEmStream()
+    with pq.ParquetWriter(saida, esquema, compression='snappy') as escritor:
+        for lote in _em_lotes(projetar_protocolos(query, campos), current_app.config['EXPORTACAO_LOTE']):
+            colunas = [pa.array([linha[i] for linha in lote], type=esquema.field(i).type) for i in range(len(campos))]
+            escritor.write_batch(pa.record_batch(colunas, schema=esquema))
+            yield saida.retirar()
+    yield saida.retirar()
+
+# Os dados_preenchidos de um protocolo podem ter milhares de linhas; menos protocolos por lote
+LOTE_DADOS_MODELO = 100
+COLUNAS_METADADOS_MODELO = ['protocolo_id', 'numero_protocolo', 'status', 'data_criacao', 'setor_destinatario', 'linha']
+_ESPACOS = re.compile(r'\s*')
+_decodificador = json.JSONDecoder()
+
+def _proximo_caractere(texto, posicao):
+    """Posição e caractere seguintes, pulando espaços. ValueError se o texto acabar (JSON truncado)."""
+    posicao = _ESPACOS.match(texto, posicao).end()
+    if posicao >= len(texto):
+        raise ValueError("JSON truncado.")
+    return posicao, texto[posicao]
+
+def itens_do_array_json(texto):
+    """
+    Percorre um array JSON item a item (raw_decode a partir de cada posição), sem montar
+    a lista inteira: só o item atual fica decodificado em memória. Texto vazio ou null não
+    gera nenhum item; qualquer outro texto que não seja um array JSON completo gera ValueError.
+    """
+    texto = texto or ''
+    posicao = _ESPACOS.match(texto).end()
+    if posicao == len(texto) or texto.startswith('null', posicao):
+        return
+    if texto[posicao] != '[':
+        raise ValueError("dados_preenchidos não é uma lista JSON.")
+    posicao, caractere = _proximo_caractere(texto, posicao + 1)
+    if caractere == ']':
+        return
+    while True:
+        item, posicao = _decodificador.raw_decode(texto, posicao)
+        yield item
+        posicao, caractere = _proximo_caractere(texto, posicao)
+        if caractere == ']':
+            return
+        if caractere != ',':
+            raise ValueError(f"JSON inválido na posição {posicao}.")
+        posicao = _proximo_caractere(texto, posicao + 1)[0]
+
+def _valor_csv(valor):
+    if isinstance(valor, (dict, list)):
+        return json.dumps(valor, ensure_ascii=False)
+    return valor
+
+def csv_dos_dados_do_modelo(query, modelo):
+    """
+    Gera um CSV com uma linha por registro dos dados_preenchidos de cada protocolo da consulta
+    que usa o modelo: metadados do protocolo, os campos do modelo (na ordem do CampoModelo)
+    e _conferido. O JSON vem do banco como texto e é lido um registro por vez.
+    """
+    nomes_campos = list(dict.fromkeys(
+        nome for (nome,) in CampoModelo.query.with_entities(CampoModelo.nome_campo)
+        .filter_by(modelo_id=modelo.id).order_by(CampoModelo.ordem, CampoModelo.id)
+    ))
+    linhas = query.filter(Protocolo.modelo_usado_id == modelo.id) \
+        .join(Setor, Setor.id == Protocolo.setor_destinatario_id) \
+        .with_entities(
+            Protocolo.id, Protocolo.numero_protocolo, Protocolo.status, Protocolo.data_criacao, Setor.nome,
+            type_coerce(Protocolo.dados_preenchidos, Text)  # texto cru, sem o json.loads do tipo JSON
+        ) \
+        .order_by(Protocolo.data_criacao.desc()) \
+        .yield_per(LOTE_DADOS_MODELO)
+
+    texto = io.StringIO()
+    escritor = csv.writer(texto)
+    escritor.writerow(COLUNAS_METADADOS_MODELO + nomes_campos + ['_conferido'])
+    for protocolo_id, numero, status, data_criacao, setor, dados in linhas:
+        try:
+            for indice, registro in enumerate(itens_do_array_json(dados)):
+                escritor.writerow(
+                    [protocolo_id, numero, status, data_criacao, setor, indice] +
+                    [_valor_csv(registro.get(nome)) for nome in nomes_campos] +
+                    [registro.get('_conferido')]
+                )
+        except (ValueError, AttributeError):
+            current_app.logger.warning(f"dados_preenchidos inválido no protocolo {numero}; exportação parcial.")
+        if texto.tell() >= TAMANHO_BLOCO:
+            yield texto.getvalue().encode('utf-8')
+            texto.seek(0)
+            texto.truncate()
+    yield texto.getvalue().encode('utf-8')
+
+COLUNAS_AUDITORIA = ['id', 'data_ocorrencia', 'protocolo_id', 'numero_protocolo', 'colaborador_id', 'colaborador', 'descricao']
+
+def csv_da_auditoria(filtros):
+    """
+    Gera o CSV da trilha de auditoria (Historico com os filtros dados, mais recentes primeiro).
+    É um SELECT só de colunas, com o número do protocolo e o nome do colaborador via JOIN,
+    lido por cursor do lado do servidor em lotes de EXPORTACAO_LOTE: nenhum objeto do ORM é montado.
+    """
+    consulta = select(
+        Historico.id, Historico.data_ocorrencia, Historico.protocolo_id, Protocolo.numero_protocolo,
+        Historico.colaborador_id, Colaborador.nome, Historico.descricao
+    ).join(Protocolo, Protocolo.id == Historico.protocolo_id) \
+        .join(Colaborador, Colaborador.id == Historico.colaborador_id) \
+        .where(*filtros) \
+        .order_by(Historico.data_ocorrencia.desc(), Historico.id.desc()) \
+        .execution_options(yield_per=current_app.config['EXPORTACAO_LOTE'])  # yield_per liga o stream_results
+
+    texto = io.StringIO()
+    escritor = csv.writer(texto)
+    escritor.writerow(COLUNAS_AUDITORIA)
+    for lote in db.session.execute(consulta).partitions():
+        escritor.writerows(lote)
+        yield texto.getvalue().encode('utf-8')
+        texto.seek(0)
+        texto.truncate()
+    yield texto.getvalue().encode('utf-8')
+
+COLUNAS_EXCEL = ['Número Protocolo', 'Status', 'Assunto', 'Criado Por', 'Data Criação', 'Setor Destino', 'Destinatário Específico']
+
+def planilha_de_protocolos(query):
+    """
+    Grava a planilha .xlsx dos protocolos da consulta e devolve o arquivo já no início.
+    Uma única consulta traz só as colunas da planilha (com os nomes via JOIN), lida em
+    lotes de EXPORTACAO_LOTE linhas; o openpyxl em modo write-only descarrega cada linha
+    no disco, e o .xlsx final só fica em memória até EXPORTACAO_SPOOL_MB.
+    """
+    workbook = Workbook(write_only=True)
+    planilha = workbook.create_sheet('Protocolos')
+    planilha.append(COLUNAS_EXCEL)
+    for numero, status, assunto, criado_por, data_criacao, setor, nome_destinatario in projetar_protocolos(query, CAMPOS_PADRAO):
+        planilha.append([
+            numero, status, assunto, criado_por, data_criacao.strftime('%d/%m/%Y %H:%M'), setor, nome_destinatario or ''
+        ])
+
+    arquivo = tempfile.SpooledTemporaryFile(max_size=current_app.config['EXPORTACAO_SPOOL_MB'] * 1024 * 1024)
+    workbook.save(arquivo)
+    arquivo.seek(0)
+    return arquivo
@@ -1,13 +1,44 @@
 from app import db, login_manager, bcrypt
+from flask import current_app
 from flask_login import UserMixin
 from datetime import datetime
+import time
 import sqlalchemy as sa # Adicione esta linha
 from sqlalchemy.dialects import mssql # Adicione esta linha
+from sqlalchemy.orm import joinedload
 
+# Cache de identidade do Flask-Login: colaborador_id -> (expira_em, Colaborador desanexado).
+# A cópia em cache nunca é alterada; cada request recebe um merge dela na própria sessão.
+_cache_identidades = {}
 
 @login_manager.user_loader
 def load_user(user_id):
-    return Colaborador.query.get(int(user_id))
+    user_id = int(user_id)
+    em_cache = _cache_identidades.get(user_id)
+    if em_cache is None or em_cache[0] <= time.monotonic():
+        # Colaborador, perfil, permissões e setor em um único SELECT, numa sessão
+        # separada para que a cópia guardada não seja tocada pelo request
+        sessao = db.session.session_factory()
+        try:
+            colaborador = sessao.query(Colaborador).options(
+                joinedload(Colaborador.perfil).joinedload(Perfil.permissoes),
+                joinedload(Colaborador.setor)
+            ).filter(Colaborador.id == user_id).first()
+        finally:
+            sessao.close()
+        if colaborador is None:
+            return None
+        if colaborador.perfil:
+            _cache_permissoes.setdefault(colaborador.perfil_id, frozenset(p.nome for p in colaborador.perfil.permissoes))
+        em_cache = (time.monotonic() + current_app.config['IDENTIDADE_CACHE_TTL'], colaborador)
+        _cache_identidades[user_id] = em_cache
+    return db.session.merge(em_cache[1], load=False)
+
+def invalidar_cache_identidade(colaborador_id=None):
+    if colaborador_id is None:
+        _cache_identidades.clear()
+    else:
+        _cache_identidades.pop(colaborador_id, None)
 
 class Setor(db.Model):
     __tablename__ = 'Setor'
@@ -22,6 +53,28 @@ perfil_permissoes = db.Table('perfil_permissoes',
     db.Column('permissao_id', db.Integer, db.ForeignKey('Permissao.id'), primary_key=True)
 )
 
+# Permissões de cada perfil compiladas uma vez por processo: perfil_id -> frozenset de nomes.
+# Invalidado por adicionar_perfil/editar_perfil (e pelo comando seed).
+_cache_permissoes = {}
+
+def permissoes_do_perfil(perfil_id):
+    if perfil_id is None:
+        return frozenset()
+    permissoes = _cache_permissoes.get(perfil_id)
+    if permissoes is None:
+        nomes = db.session.query(Permissao.nome).join(
+            perfil_permissoes, perfil_permissoes.c.permissao_id == Permissao.id
+        ).filter(perfil_permissoes.c.perfil_id == perfil_id).all()
+        permissoes = frozenset(nome for (nome,) in nomes)
+        _cache_permissoes[perfil_id] = permissoes
+    return permissoes
+
+def invalidar_cache_permissoes(perfil_id=None):
+    if perfil_id is None:
+        _cache_permissoes.clear()
+    else:
+        _cache_permissoes.pop(perfil_id, None)
+
 class Permissao(db.Model):
     __tablename__ = 'Permissao'
     id = db.Column(db.Integer, primary_key=True)
@@ -46,13 +99,17 @@ class Colaborador(db.Model, UserMixin):
     senha_hash = db.Column(db.String(255), nullable=False)
     perfil_id = db.Column(db.Integer, db.ForeignKey('Perfil.id'))
     setor_id = db.Column(db.Integer, db.ForeignKey('Setor.id'))
+    # Minutos entre os emails de resumo das notificações (0 = um email por evento)
+    intervalo_resumo = db.Column(db.Integer, nullable=False, default=0, server_default=sa.text('0'))
     protocolos_criados = db.relationship('Protocolo', backref='criado_por', lazy=True, foreign_keys='Protocolo.criado_por_id')
     historicos_criados = db.relationship('Historico', backref='colaborador', lazy=True)
 
+    @property
+    def permissoes(self):
+        return permissoes_do_perfil(self.perfil_id)
+
     def tem_permissao(self, nome_permissao):
-        if not self.perfil:
-            return False
-        return any(p.nome == nome_permissao for p in self.perfil.permissoes)
+        return nome_permissao in self.permissoes
     
     @property
     def senha(self):
@@ -105,6 +162,56 @@ class Protocolo(db.Model):
     historico = db.relationship('Historico', backref='protocolo', lazy=True, cascade="all, delete-orphan")
     anexos = db.relationship('Anexo', backref='protocolo', lazy=True, cascade="all, delete-orphan")
 
+    # Índices das consultas do dashboard, Kanban, Meus Relatórios e relatórios gerenciais
+    __table_args__ = (
+        db.Index('ix_Protocolo_data_criacao_id', 'data_criacao', 'id'),
+        db.Index('ix_Protocolo_status_data_criacao', 'status', 'data_criacao'),
+        db.Index('ix_Protocolo_setor_status_data', 'setor_destinatario_id', 'status', 'data_criacao'),
+        db.Index('ix_Protocolo_criado_por_status_data', 'criado_por_id', 'status', 'data_criacao'),
+        db.Index('ix_Protocolo_colab_dest_status_data', 'colaborador_destinatario_id', 'status', 'data_criacao'),
+        db.Index('ix_Protocolo_modelo_data_criacao', 'modelo_usado_id', 'data_criacao'),
+    )
+
+class SequenciaProtocolo(db.Model):
+    # Contador por ano usado para gerar o numero_protocolo (ver app/numeracao.py)
+    __tablename__ = 'SequenciaProtocolo'
+    ano = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ultimo_numero = db.Column(db.Integer, nullable=False, default=0)
+
+class ContadorProtocolo(db.Model):
+    # Total de protocolos por status x setor x modelo, mantido por app/contadores.py
+    __tablename__ = 'ContadorProtocolo'
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(50), nullable=False)
+    setor_id = db.Column(db.Integer, db.ForeignKey('Setor.id'), nullable=False)
+    modelo_id = db.Column(db.Integer, nullable=False, default=0) # 0 = sem modelo
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('status', 'setor_id', 'modelo_id', name='uq_ContadorProtocolo_chave'),
+    )
+
+class ResumoDiarioProtocolo(db.Model):
+    # Protocolos criados por dia x status x setor x modelo, mantido por app/contadores.py
+    __tablename__ = 'ResumoDiarioProtocolo'
+    id = db.Column(db.Integer, primary_key=True)
+    dia = db.Column(db.Date, nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    setor_id = db.Column(db.Integer, db.ForeignKey('Setor.id'), nullable=False)
+    modelo_id = db.Column(db.Integer, nullable=False, default=0) # 0 = sem modelo
+    total = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('dia', 'status', 'setor_id', 'modelo_id', name='uq_ResumoDiarioProtocolo_chave'),
+    )
+
+class TermoBusca(db.Model):
+    # Índice invertido da busca do dashboard (ver app/busca.py)
+    __tablename__ = 'TermoBusca'
+    termo = db.Column(db.String(64), primary_key=True)
+    protocolo_id = db.Column(db.Integer, db.ForeignKey('Protocolo.id'), primary_key=True, index=True)
+    peso = db.Column(db.Integer, nullable=False, default=1)
+
 class Historico(db.Model):
     __tablename__ = 'Historico'
     id = db.Column(db.Integer, primary_key=True)
@@ -113,12 +220,58 @@ class Historico(db.Model):
     protocolo_id = db.Column(db.Integer, db.ForeignKey('Protocolo.id'), nullable=False)
     colaborador_id = db.Column(db.Integer, db.ForeignKey('Colaborador.id'), nullable=False)
 
+    # Histórico do detalhe do protocolo e filtros da trilha de auditoria
+    __table_args__ = (
+        db.Index('ix_Historico_protocolo_data', 'protocolo_id', 'data_ocorrencia'),
+        db.Index('ix_Historico_data_ocorrencia', 'data_ocorrencia'),
+        db.Index('ix_Historico_colaborador_data', 'colaborador_id', 'data_ocorrencia'),
+    )
+
 class Anexo(db.Model):
     __tablename__ = 'Anexo'
     id = db.Column(db.Integer, primary_key=True)
     nome_arquivo = db.Column(db.String(255), nullable=False)
     caminho_arquivo = db.Column(db.Text, nullable=False)
+    protocolo_id = db.Column(db.Integer, db.ForeignKey('Protocolo.id'), nullable=False, index=True)
+    tamanho = db.Column(db.BigInteger) # bytes; nulo nos anexos anteriores ao registro
+    sha256 = db.Column(db.String(64))
+    mime_type = db.Column(db.String(100))
+
+class EmailPendente(db.Model):
+    # Fila de saída de emails, processada por app/email.py (flask outbox run)
+    __tablename__ = 'EmailPendente'
+    id = db.Column(db.Integer, primary_key=True)
+    assunto = db.Column(db.String(255), nullable=False)
+    destinatarios = db.Column(db.Text, nullable=False) # separados por vírgula
+    corpo_html = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pendente') # pendente, enviando, enviado, falhou
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa = db.Column(mssql.DATETIME2, nullable=False, default=datetime.now)
+    reservado_por = db.Column(db.String(64))
+    ultimo_erro = db.Column(db.Text)
+    data_criacao = db.Column(mssql.DATETIME2, nullable=False, server_default=sa.text('(getdate())'))
+    data_envio = db.Column(mssql.DATETIME2)
+
+    __table_args__ = (
+        db.Index('ix_EmailPendente_status_proxima', 'status', 'proxima_tentativa'),
+    )
+
+class NotificacaoPendente(db.Model):
+    # Eventos aguardando o próximo email de resumo do colaborador (ver app/email.py)
+    __tablename__ = 'NotificacaoPendente'
+    id = db.Column(db.Integer, primary_key=True)
+    colaborador_id = db.Column(db.Integer, db.ForeignKey('Colaborador.id'), nullable=False, index=True)
     protocolo_id = db.Column(db.Integer, db.ForeignKey('Protocolo.id'), nullable=False)
+    tipo = db.Column(db.String(30), nullable=False) # novo_protocolo, status_update
+    dados = db.Column(db.Text, nullable=False) # JSON com o que o template do resumo mostra
+    data_criacao = db.Column(mssql.DATETIME2, nullable=False, default=datetime.now)
+
+class ConteudoAnexo(db.Model):
+    # Conteúdo de anexo guardado uma vez por hash (ver app/armazenamento.py)
+    __tablename__ = 'ConteudoAnexo'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    tamanho = db.Column(db.BigInteger, nullable=False)
+    referencias = db.Column(db.Integer, nullable=False, default=0)
 
 class Fornecedor(db.Model):
     __tablename__ = 'Fornecedor'
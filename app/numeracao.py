@@ -0,0 +1,69 @@
+import uuid
+from datetime import date
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Protocolo, SequenciaProtocolo
+
+# Rascunhos não consomem a sequência oficial; recebem um número provisório
+# que é trocado pelo definitivo quando o rascunho é finalizado.
+PREFIXO_RASCUNHO = 'RASC-'
+
+def formatar_numero(ano, sequencial):
+    return f"{ano:04d}-{sequencial:06d}"
+
+def numero_provisorio():
+    return f"{PREFIXO_RASCUNHO}{uuid.uuid4().hex[:16].upper()}"
+
+def is_numero_provisorio(numero):
+    return bool(numero) and numero.startswith(PREFIXO_RASCUNHO)
+
+def _maior_sequencial_existente(conn, ano):
+    """Maior sequencial já gravado em Protocolo para o ano (só usado ao criar o contador do ano)."""
+    ultimo = conn.execute(
+        sa.select(sa.func.max(Protocolo.numero_protocolo))
+        .where(Protocolo.numero_protocolo.like(f'{ano:04d}-%'))
+    ).scalar()
+    try:
+        return int(ultimo.split('-')[1]) if ultimo else 0
+    except (IndexError, ValueError):
+        return 0
+
+def reservar_numeros(quantidade=1, ano=None):
+    """
+    Reserva um bloco contínuo de números de protocolo para o ano informado.
+
+    O incremento roda em uma transação própria e curta, fora da sessão do request,
+    então o lock na linha do contador dura só o UPDATE. Números reservados e não
+    usados (ex.: erro antes do commit do protocolo) viram lacunas na sequência.
+    """
+    if quantidade < 1:
+        raise ValueError("A quantidade de números reservados deve ser maior que zero.")
+    ano = ano or date.today().year
+    tabela = SequenciaProtocolo.__table__
+
+    for _ in range(3):
+        with db.engine.begin() as conn:
+            resultado = conn.execute(
+                tabela.update()
+                .where(tabela.c.ano == ano)
+                .values(ultimo_numero=tabela.c.ultimo_numero + quantidade)
+            )
+            if resultado.rowcount:
+                fim = conn.execute(
+                    sa.select(tabela.c.ultimo_numero).where(tabela.c.ano == ano)
+                ).scalar()
+                inicio = fim - quantidade + 1
+                return [formatar_numero(ano, seq) for seq in range(inicio, fim + 1)]
+
+        # Primeiro protocolo do ano: cria o contador a partir do maior número existente
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(tabela.insert().values(ano=ano, ultimo_numero=_maior_sequencial_existente(conn, ano)))
+        except IntegrityError:
+            pass  # Outro worker criou o contador primeiro; basta tentar o UPDATE de novo
+
+    raise RuntimeError(f"Não foi possível reservar números de protocolo para o ano {ano}.")
+
+def alocar_numero_protocolo(ano=None):
+    return reservar_numeros(1, ano)[0]
@@ -0,0 +1,87 @@
+import base64
+import json
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import and_, or_
+from app.models import Protocolo
+
+# Cache das contagens totais da listagem: chave -> (expira_em, total)
+_contagens = {}
+_contagens_lock = threading.Lock()
+_MAX_CONTAGENS = 1000
+
+def codificar_cursor(protocolo, direcao):
+    """Gera o token opaco que aponta para a posição (data_criacao, id) de um protocolo."""
+    dados = {'d': protocolo.data_criacao.isoformat(), 'i': protocolo.id, 'dir': direcao}
+    return base64.urlsafe_b64encode(json.dumps(dados).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decodificar_cursor(token):
+    """Retorna (data_criacao, id, direcao) ou None se o token for inválido."""
+    if not token:
+        return None
+    try:
+        preenchimento = '=' * (-len(token) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(token + preenchimento))
+        direcao = dados['dir'] if dados['dir'] in ('next', 'prev') else 'next'
+        return datetime.fromisoformat(dados['d']), int(dados['i']), direcao
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def contar_com_cache(chave, query, ttl):
+    """Conta os registros da consulta reaproveitando o resultado por `ttl` segundos."""
+    agora = time.monotonic()
+    with _contagens_lock:
+        em_cache = _contagens.get(chave)
+        if em_cache and em_cache[0] > agora:
+            return em_cache[1]
+
+    total = query.order_by(None).count()
+
+    with _contagens_lock:
+        if len(_contagens) >= _MAX_CONTAGENS:
+            _contagens.clear()
+        _contagens[chave] = (agora + ttl, total)
+    return total
+
+class PaginaKeyset:
+    """Página da listagem paginada por cursor; imita os atributos usados do Pagination do Flask-SQLAlchemy."""
+    is_keyset = True
+
+    def __init__(self, items, per_page, has_next, has_prev, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+        self.next_cursor = codificar_cursor(items[-1], 'next') if has_next and items else None
+        self.prev_cursor = codificar_cursor(items[0], 'prev') if has_prev and items else None
+
+def paginar_keyset(query, per_page, token=None, total=None):
+    """
+    Pagina a consulta de protocolos em ordem decrescente de (data_criacao, id) sem OFFSET.
+
+    Cada página busca per_page + 1 linhas a partir da posição do cursor; a linha extra só
+    indica se existe uma próxima página na mesma direção.
+    """
+    cursor = decodificar_cursor(token)
+    chave_data, chave_id = Protocolo.data_criacao, Protocolo.id
+
+    if cursor is None:
+        linhas = query.order_by(chave_data.desc(), chave_id.desc()).limit(per_page + 1).all()
+        return PaginaKeyset(linhas[:per_page], per_page, has_next=len(linhas) > per_page, has_prev=False, total=total)
+
+    data_cursor, id_cursor, direcao = cursor
+    if direcao == 'next':
+        linhas = query.filter(or_(
+            chave_data < data_cursor,
+            and_(chave_data == data_cursor, chave_id < id_cursor)
+        )).order_by(chave_data.desc(), chave_id.desc()).limit(per_page + 1).all()
+        return PaginaKeyset(linhas[:per_page], per_page, has_next=len(linhas) > per_page, has_prev=True, total=total)
+
+    linhas = query.filter(or_(
+        chave_data > data_cursor,
+        and_(chave_data == data_cursor, chave_id > id_cursor)
+    )).order_by(chave_data.asc(), chave_id.asc()).limit(per_page + 1).all()
+    items = list(reversed(linhas[:per_page]))
+    return PaginaKeyset(items, per_page, has_next=True, has_prev=len(linhas) > per_page, total=total)
@@ -0,0 +1,261 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from app.models import Historico
+
+CSS_PAGINA = '@page { size: A4 landscape; margin: 1.5cm; }'
+
+def renderizar_pdf(html, base_url):
+    """HTML do template pdf/protocolo_pdf.html -> bytes do PDF (WeasyPrint)."""
+    # Importado aqui: só os processos do pool de renderização carregam o WeasyPrint
+    from weasyprint import HTML
+    from weasyprint.css import CSS
+    return HTML(string=html, base_url=base_url).write_pdf(stylesheets=[CSS(string=CSS_PAGINA)])
+
+def versao_do_protocolo(protocolo):
+    """
+    Muda sempre que o PDF do protocolo mudaria: status/número, nova tramitação (último
+    Historico), anexos e as linhas do modelo (que a conferência altera sem gerar histórico).
+    """
+    ultimo_historico = db.session.query(func.max(Historico.id)).filter(Historico.protocolo_id == protocolo.id).scalar()
+    partes = [
+        protocolo.status,
+        protocolo.numero_protocolo,
+        ultimo_historico,
+        sorted((anexo.id, anexo.sha256) for anexo in protocolo.anexos),
+        protocolo.dados_preenchidos,
+    ]
+    return hashlib.sha1(json.dumps(partes, default=str, sort_keys=True).encode('utf-8')).hexdigest()
+
+class CachePDF:
+    """
+    PDFs renderizados em disco, um arquivo por protocolo + versão. Passando de max_bytes,
+    remove os menos acessados (o mtime é atualizado a cada leitura).
+    """
+
+    def __init__(self, diretorio, max_bytes):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        os.makedirs(diretorio, exist_ok=True)
+
+    def caminho(self, protocolo_id, versao):
+        return os.path.join(self.diretorio, f"{protocolo_id}-{versao}.pdf")
+
+    def get(self, protocolo_id, versao):
+        caminho = self.caminho(protocolo_id, versao)
+        try:
+            os.utime(caminho)
+        except FileNotFoundError:
+            return None
+        return caminho
+
+    def set(self, protocolo_id, versao, conteudo):
+        caminho = self.caminho(protocolo_id, versao)
+        temporario = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporario, 'wb') as arquivo:
+            arquivo.write(conteudo)
+        os.replace(temporario, caminho)
+        self._despejar()
+        return caminho
+
+    def invalidar(self, protocolo_id):
+        prefixo = f"{protocolo_id}-"
+        for entrada in os.scandir(self.diretorio):
+            if entrada.name.startswith(prefixo) and entrada.name.endswith('.pdf'):
+                try:
+                    os.remove(entrada.path)
+                except FileNotFoundError:
+                    pass
+
+    def _despejar(self):
+        entradas = []
+        for entrada in os.scandir(self.diretorio):
+            if entrada.is_file() and entrada.name.endswith('.pdf'):
+                try:
+                    estado = entrada.stat()
+                except FileNotFoundError:
+                    continue
+                entradas.append((estado.st_mtime, estado.st_size, entrada.path))
+        total = sum(tamanho for _, tamanho, _ in entradas)
+        for _, tamanho, caminho in sorted(entradas):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(caminho)
+            except FileNotFoundError:
+                pass
+            total -= tamanho
+
+def obter_cache_pdf():
+    app = current_app._get_current_object()
+    cache = app.extensions.get('cache_pdf')
+    if cache is None:
+        cache = CachePDF(app.config['PDF_CACHE_DIR'], app.config['PDF_CACHE_MAX_MB'] * 1024 * 1024)
+        app.extensions['cache_pdf'] = cache
+    return cache
+
+def invalidar_pdf(protocolo_id):
+    obter_cache_pdf().invalidar(protocolo_id)
+
+def _renderizar_com_limite(html, base_url, timeout, marca_expirado):
+    """
+    Roda no processo do pool. Se a renderização passar do timeout, cria o arquivo `marca_expirado`
+    e encerra o processo (o WeasyPrint não tem como ser interrompido). Isso derruba o pool inteiro:
+    a marca diz ao ServicoPDF qual job estourou o tempo, e os outros são reenviados.
+    """
+    def expirar():
+        with open(marca_expirado, 'w'):
+            pass
+        os._exit(1)
+
+    vigia = threading.Timer(timeout, expirar)
+    vigia.daemon = True
+    vigia.start()
+    try:
+        return renderizar_pdf(html, base_url)
+    finally:
+        vigia.cancel()
+
+class ServicoPDF:
+    """
+    Renderiza PDFs num pool de processos (PDF_WORKERS), fora das threads do waitress.
+
+    O id do job é "<protocolo_id>-<versao>": pedidos repetidos do mesmo PDF viram um
+    único job, e o resultado vai para o CachePDF, então qualquer processo consegue
+    entregar um job que já terminou.
+    """
+
+    # Envios de um job que caiu junto com o pool sem ter estourado o tempo (ex.: outro job expirou)
+    max_tentativas = 3
+
+    def __init__(self, workers, timeout, cache):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache = cache
+        self._jobs = {}
+        self._lock = threading.RLock()  # o callback pode rodar na mesma thread que submeteu
+        self._concluido = threading.Condition(self._lock)
+        self._pool = None
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def _marca_expirado(self, job_id):
+        return os.path.join(self.cache.diretorio, f"{job_id}.expirado")
+
+    def _enviar(self, job_id, job):
+        marca = self._marca_expirado(job_id)
+        if os.path.exists(marca):
+            os.remove(marca)
+        argumentos = (_renderizar_com_limite, job['html'], job['base_url'], self.timeout, marca)
+        try:
+            futuro = self._executor().submit(*argumentos)
+        except BrokenProcessPool:
+            # Um job anterior estourou o tempo e derrubou o pool; começa outro
+            self._pool = None
+            futuro = self._executor().submit(*argumentos)
+        job['pool'] = self._pool
+        job['futuro'] = futuro
+        futuro.add_done_callback(lambda f: self._concluir(job_id, f))
+
+    def _concluir(self, job_id, futuro):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['futuro'] is not futuro:
+                return
+            try:
+                self.cache.set(job['protocolo_id'], job['versao'], futuro.result())
+                del self._jobs[job_id]
+            except BrokenProcessPool:
+                # Todos os jobs do pool quebrado passam por aqui; só o primeiro troca o pool
+                if self._pool is job['pool']:
+                    self._pool = None
+                    job['pool'].shutdown(wait=False)
+                marca = self._marca_expirado(job_id)
+                if os.path.exists(marca):
+                    os.remove(marca)
+                    job['erro'] = 'Tempo esgotado ao gerar o PDF.'
+                    job['html'] = None
+                elif job['tentativas'] >= self.max_tentativas:
+                    job['erro'] = 'Falha ao gerar o PDF.'
+                    job['html'] = None
+                else:
+                    # Caiu junto com outro job que estourou o tempo; tenta de novo num pool novo
+                    job['tentativas'] += 1
+                    self._enviar(job_id, job)
+            except Exception as e:
+                job['erro'] = f"Falha ao gerar o PDF: {e}"
+                job['html'] = None
+            finally:
+                self._concluido.notify_all()
+
+    def submeter(self, protocolo_id, versao, html, base_url):
+        job_id = f"{protocolo_id}-{versao}"
+        if self.cache.get(protocolo_id, versao):
+            return job_id
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.get('erro'):
+                job = {'protocolo_id': protocolo_id, 'versao': versao, 'html': html, 'base_url': base_url, 'tentativas': 1}
+                self._jobs[job_id] = job
+                self._enviar(job_id, job)
+        return job_id
+
+    def status(self, job_id):
+        """'pronto', 'processando', 'erro' (com a mensagem) ou 'desconhecido' (outro processo ou job antigo)."""
+        protocolo_id, versao = job_id.split('-', 1)
+        if self.cache.get(protocolo_id, versao):
+            return 'pronto', None
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return 'desconhecido', None
+        if job.get('erro'):
+            return 'erro', job['erro']
+        return 'processando', None
+
+    def aguardar(self, job_id):
+        """Espera o job terminar (até o timeout) e devolve o caminho do PDF no cache."""
+        # Espera pela conclusão registrada em _concluir, e não pelo futuro: se o pool cair,
+        # o job é reenviado com outro futuro e a espera continua até o fim do prazo
+        limite = time.monotonic() + self.timeout
+        with self._concluido:
+            while self.status(job_id)[0] == 'processando':
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                self._concluido.wait(restante)
+        return self.cache.get(*job_id.split('-', 1))
+
+    def em_ordem_de_conclusao(self, job_ids):
+        """Gera (job_id, caminho do PDF ou None) conforme os jobs terminam, na ordem em que terminam."""
+        pendentes = list(job_ids)
+        while pendentes:
+            with self._concluido:
+                terminados = [job_id for job_id in pendentes if self.status(job_id)[0] != 'processando']
+                if not terminados:
+                    self._concluido.wait(1)
+                    continue
+            for job_id in terminados:
+                pendentes.remove(job_id)
+                yield job_id, self.cache.get(*job_id.split('-', 1))
+
+_lock_servico = threading.Lock()
+
+def obter_servico_pdf():
+    app = current_app._get_current_object()
+    with _lock_servico:
+        servico = app.extensions.get('servico_pdf')
+        if servico is None:
+            servico = ServicoPDF(app.config['PDF_WORKERS'], app.config['PDF_TIMEOUT'], obter_cache_pdf())
+            app.extensions['servico_pdf'] = servico
+    return servico
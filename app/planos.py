@@ -0,0 +1,206 @@
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from flask_login import login_user
+from sqlalchemy import event, func
+from werkzeug.datastructures import MultiDict
+from app import db
+from app.models import Protocolo, Colaborador, Perfil, Permissao
+from app.caixa_entrada import carregar_caixa, pagina_da_secao, SECOES
+from app.carregamento import com_perfil
+from app.paginacao import codificar_cursor
+
+# Operadores que indicam leitura da tabela inteira / do índice inteiro
+SCANS_DE_TABELA = {'Table Scan', 'Clustered Index Scan'}
+SCAN_DE_INDICE = 'Index Scan'
+TABELAS_MONITORADAS = {'Protocolo', 'Historico', 'TermoBusca', 'ResumoDiarioProtocolo', 'ContadorProtocolo', 'Setor'}
+NS_SHOWPLAN = {'p': 'http://schemas.microsoft.com/sqlserver/2004/07/showplan'}
+
+class Checagem:
+    """
+    Uma consulta quente de rota. `executar` chama, logado como `usuario`, os mesmos helpers que
+    a rota usa, e todo SELECT que eles emitirem tem o plano verificado, com os parâmetros reais.
+    `le_tabela_inteira` são as tabelas que a consulta precisa ler por completo (agregados sobre
+    tabelas de tamanho limitado, como os contadores); scans em qualquer outra tabela contam.
+    """
+
+    def __init__(self, nome, usuario, executar, permite_scan_de_indice=False, le_tabela_inteira=()):
+        self.nome = nome
+        self.usuario = usuario
+        self.executar = executar
+        self.permite_scan_de_indice = permite_scan_de_indice
+        self.le_tabela_inteira = set(le_tabela_inteira)
+
+def _checagens(colaborador, administrador):
+    """As consultas das rotas, montadas pelos helpers de app/routes.py e app/caixa_entrada.py."""
+    from app.routes import (
+        BuscaProtocoloForm, AuditoriaForm, STATUS_KANBAN, _consulta_dashboard, _pagina_dashboard,
+        _totais_kanban, _coluna_kanban, _consulta_auditoria, _consulta_protocolos_por_dia,
+        _consulta_protocolos_por_status, _consulta_protocolos_por_setor
+    )
+
+    def dashboard(**filtros):
+        return _consulta_dashboard(BuscaProtocoloForm(MultiDict(filtros), meta={'csrf': False}))
+
+    def auditoria(**filtros):
+        return _consulta_auditoria(AuditoriaForm(MultiDict(filtros), meta={'csrf': False}))
+
+    # Cursor de uma página seguinte qualquer: o plano não depende de onde a página começa
+    cursor = codificar_cursor(Protocolo(id=2 ** 31 - 1, data_criacao=datetime.utcnow()), 'next')
+    hoje = date.today()
+    um_ano_atras = hoje - timedelta(days=365)
+
+    checagens = []
+    for usuario, rotulo in ((administrador, 'admin'), (colaborador, 'colaborador')):
+        if usuario is None:
+            continue
+        # Sem filtro, o admin lê o índice de data em ordem e para no TOP/LIMIT (e a contagem lê um índice)
+        scan_de_indice = usuario is administrador
+        checagens += [
+            # index() e exportações (todas partem de _consulta_dashboard)
+            Checagem(f'index ({rotulo})', usuario, lambda: _pagina_dashboard(dashboard(), 'offset', 1, 25),
+                     permite_scan_de_indice=scan_de_indice),
+            Checagem(f'index ({rotulo}, cursor)', usuario, lambda: _pagina_dashboard(dashboard(), 'cursor', 1, 25, cursor),
+                     permite_scan_de_indice=scan_de_indice),
+            Checagem(f'index ({rotulo}, busca)', usuario,
+                     lambda: _pagina_dashboard(dashboard(termo_busca='protocolo 2025'), 'cursor', 1, 25),
+                     permite_scan_de_indice=scan_de_indice),
+            Checagem(f'index ({rotulo}, filtro de status)', usuario,
+                     lambda: _pagina_dashboard(dashboard(status='Aberto'), 'cursor', 1, 25)),
+            Checagem(f'kanban ({rotulo}, totais)', usuario, lambda: _totais_kanban(dashboard()),
+                     permite_scan_de_indice=scan_de_indice),
+            Checagem(f'kanban ({rotulo}, coluna)', usuario,
+                     lambda: [_coluna_kanban(dashboard(), status, cursor) for status in STATUS_KANBAN]),
+        ]
+
+    if colaborador is not None:
+        checagens += [
+            # meus_relatorios() / api_caixa_entrada()
+            Checagem('meus_relatorios (caixa)', colaborador, lambda: carregar_caixa(colaborador)),
+            Checagem('meus_relatorios (página seguinte)', colaborador,
+                     lambda: [pagina_da_secao(colaborador, secao, cursor) for secao in SECOES]),
+        ]
+
+    if administrador is not None:
+        checagens += [
+            # protocolo_detalhe()
+            Checagem('protocolo_detalhe', administrador, lambda: com_perfil(Protocolo.query, 'detail').get(
+                db.session.query(func.max(Protocolo.id)).scalar() or 0
+            )),
+            # relatorio_auditoria()
+            Checagem('relatorio_auditoria', administrador,
+                     lambda: auditoria().paginate(page=1, per_page=25, error_out=False), permite_scan_de_indice=True),
+            Checagem('relatorio_auditoria (colaborador)', administrador,
+                     lambda: auditoria(colaborador=str(administrador.id)).paginate(page=1, per_page=25, error_out=False)),
+            Checagem('relatorio_auditoria (período)', administrador,
+                     lambda: auditoria(data_inicio=um_ano_atras.isoformat()).paginate(page=1, per_page=25, error_out=False)),
+            # APIs de relatórios
+            Checagem('api_protocolos_por_mes', administrador,
+                     lambda: _consulta_protocolos_por_dia(um_ano_atras, hoje).all()),
+            # Os contadores têm uma linha por status x setor x modelo, não por protocolo: lê-los inteiros é o plano esperado
+            Checagem('api_protocolos_por_status', administrador, lambda: _consulta_protocolos_por_status().all(),
+                     le_tabela_inteira={'ContadorProtocolo'}),
+            Checagem('api_protocolos_por_setor', administrador, lambda: _consulta_protocolos_por_setor().all(),
+                     le_tabela_inteira={'ContadorProtocolo', 'Setor'}),
+        ]
+    return checagens
+
+@contextmanager
+def _selects_emitidos():
+    """Coleta (sql, parâmetros) de cada SELECT que a aplicação mandar ao banco dentro do bloco."""
+    emitidos = []
+
+    def registrar(conn, cursor, sql, parametros, contexto, executemany):
+        if not executemany and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            emitidos.append((sql, parametros))
+
+    event.listen(db.engine, 'before_cursor_execute', registrar)
+    try:
+        yield emitidos
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', registrar)
+
+def _operadores_mssql(conn, sql, parametros):
+    """Captura o plano estimado (SHOWPLAN_XML) e devolve [(operador, tabela)]."""
+    conn.exec_driver_sql('SET SHOWPLAN_XML ON')
+    try:
+        plano = conn.exec_driver_sql(sql, parametros).scalar()
+    finally:
+        conn.exec_driver_sql('SET SHOWPLAN_XML OFF')
+
+    operadores = []
+    for relop in ET.fromstring(plano).iter(f"{{{NS_SHOWPLAN['p']}}}RelOp"):
+        objeto = relop.find('.//p:Object', NS_SHOWPLAN)
+        tabela = objeto.get('Table', '').strip('[]') if objeto is not None else ''
+        operadores.append((relop.get('PhysicalOp'), tabela))
+    return operadores
+
+def _operadores_sqlite(conn, sql, parametros):
+    """Traduz o EXPLAIN QUERY PLAN do SQLite para os mesmos nomes de operador do SQL Server."""
+    operadores = []
+    for linha in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', parametros):
+        detalhe = [p for p in linha[-1].split() if p != 'TABLE']  # versões antigas escrevem 'SCAN TABLE x'
+        if len(detalhe) < 2 or detalhe[0] != 'SCAN':
+            continue
+        operador = SCAN_DE_INDICE if 'INDEX' in detalhe else 'Table Scan'
+        operadores.append((operador, detalhe[1]))
+    return operadores
+
+def verificar_planos(colaborador, administrador=None):
+    """
+    Retorna [(nome da checagem, [problemas])] para todas as consultas monitoradas. As checagens
+    do dashboard rodam como `colaborador` e como `administrador` (cada um segue um caminho de filtro).
+    """
+    resultados = []
+    for checagem in _checagens(colaborador, administrador):
+        with current_app.test_request_context(), _selects_emitidos() as emitidos:
+            login_user(checagem.usuario)
+            checagem.executar()
+        db.session.rollback()
+
+        problemas = []
+        with db.engine.connect() as conn:
+            capturar = _operadores_mssql if conn.dialect.name == 'mssql' else _operadores_sqlite
+            for sql, parametros in emitidos:
+                for operador, tabela in capturar(conn, sql, parametros):
+                    if tabela not in TABELAS_MONITORADAS or tabela in checagem.le_tabela_inteira:
+                        continue
+                    if operador in SCANS_DE_TABELA or (operador == SCAN_DE_INDICE and not checagem.permite_scan_de_indice):
+                        problema = f"{operador} em {tabela}"
+                        if problema not in problemas:
+                            problemas.append(problema)
+        resultados.append((checagem.nome, problemas))
+    return resultados
+
+def _primeiro_colaborador(administrador):
+    """Primeiro colaborador com (ou sem) a permissão de administrador."""
+    e_admin = Colaborador.perfil.has(Perfil.permissoes.any(Permissao.nome == 'acessar_painel_admin'))
+    return Colaborador.query.filter(e_admin if administrador else ~e_admin).order_by(Colaborador.id).first()
+
+planos_cli = AppGroup('planos', help='Verificação dos planos de execução das consultas principais.')
+
+@planos_cli.command('verificar')
+@click.option('--colaborador-id', type=int, help='Colaborador sem perfil de administrador (padrão: o primeiro cadastrado).')
+@click.option('--administrador-id', type=int, help='Colaborador com acesso ao painel admin (padrão: o primeiro cadastrado).')
+def verificar(colaborador_id, administrador_id):
+    """Falha (código de saída 1) se alguma consulta monitorada passar a fazer scan."""
+    colaborador = Colaborador.query.get(colaborador_id) if colaborador_id else _primeiro_colaborador(False)
+    administrador = Colaborador.query.get(administrador_id) if administrador_id else _primeiro_colaborador(True)
+    if not colaborador and not administrador:
+        raise click.ClickException('Nenhum colaborador encontrado para montar as consultas.')
+
+    falhas = 0
+    for nome, problemas in verificar_planos(colaborador, administrador):
+        if problemas:
+            falhas += 1
+            print(f"FALHA  {nome}: {', '.join(problemas)}")
+        else:
+            print(f"OK     {nome}")
+
+    if falhas:
+        print(f"\n{falhas} consulta(s) com regressão de plano.")
+        raise SystemExit(1)
+    print("\nTodos os planos usam os índices esperados.")
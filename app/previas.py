@@ -0,0 +1,139 @@
+import mimetypes
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from app import db
+from app.models import Anexo
+from app.anexos import anexos_cli, caminho_do_anexo
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Sem Pillow os anexos só não ganham prévia
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+# Maior lado, em pixels, de cada tipo de prévia
+TAMANHOS = {'miniatura': 160, 'previa': 900}
+MIMES_IMAGEM = {'image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/bmp'}
+
+def caminho_da_previa(anexo, tipo):
+    """As prévias ficam ao lado do arquivo do anexo (no armazenamento por conteúdo, uma por conteúdo)."""
+    return f"{caminho_do_anexo(anexo)}.{tipo}.jpg"
+
+def previa_disponivel(anexo):
+    return os.path.exists(caminho_da_previa(anexo, 'miniatura'))
+
+def _mime(anexo):
+    # Anexos antigos não têm mime_type gravado
+    return anexo.mime_type or mimetypes.guess_type(anexo.nome_arquivo)[0]
+
+def suporta_previa(anexo):
+    if _mime(anexo) in MIMES_IMAGEM:
+        return Image is not None
+    if _mime(anexo) == 'application/pdf':
+        return Image is not None and (fitz is not None or shutil.which('pdftoppm') is not None)
+    return False
+
+def renderizadores_ausentes():
+    """O que falta instalar para haver prévia de cada tipo de anexo (vazio quando não falta nada)."""
+    if Image is None:
+        return ['Pillow (nenhum anexo terá prévia)']
+    if fitz is None and shutil.which('pdftoppm') is None:
+        return ['PyMuPDF ou o pdftoppm do Poppler (os PDFs ficam sem prévia)']
+    return []
+
+def _primeira_pagina_pdf(caminho, pasta_temporaria):
+    """Rasteriza a primeira página do PDF para um PNG, com PyMuPDF ou, na falta dele, o pdftoppm do Poppler."""
+    saida = os.path.join(pasta_temporaria, 'pagina')
+    if fitz is not None:
+        with fitz.open(caminho) as documento:
+            documento[0].get_pixmap(dpi=100).save(saida + '.png')
+    else:
+        subprocess.run(
+            ['pdftoppm', '-f', '1', '-l', '1', '-singlefile', '-r', '100', '-png', caminho, saida],
+            check=True, capture_output=True, timeout=60
+        )
+    return saida + '.png'
+
+def _salvar_reduzida(imagem, destino, tamanho):
+    copia = imagem.copy()
+    copia.thumbnail((tamanho, tamanho))
+    temporario = f"{destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+    copia.save(temporario, 'JPEG', quality=80, optimize=True)
+    os.replace(temporario, destino)
+
+def gerar_previas(anexo):
+    """Gera miniatura e prévia do anexo. Retorna False quando o tipo não tem prévia."""
+    if not suporta_previa(anexo):
+        return False
+    origem = caminho_do_anexo(anexo)
+    with tempfile.TemporaryDirectory() as pasta_temporaria:
+        if _mime(anexo) == 'application/pdf':
+            origem = _primeira_pagina_pdf(origem, pasta_temporaria)
+        with Image.open(origem) as imagem:
+            imagem.draft('RGB', (TAMANHOS['previa'], TAMANHOS['previa']))  # JPEG grande decodifica já reduzido
+            imagem = ImageOps.exif_transpose(imagem).convert('RGB')
+            for tipo, tamanho in TAMANHOS.items():
+                _salvar_reduzida(imagem, caminho_da_previa(anexo, tipo), tamanho)
+    return True
+
+def _gerar_em_segundo_plano(app, anexo_id):
+    with app.app_context():
+        try:
+            anexo = Anexo.query.get(anexo_id)
+            if anexo is not None and not previa_disponivel(anexo):
+                gerar_previas(anexo)
+        except Exception:
+            app.logger.exception(f"Erro ao gerar a prévia do anexo {anexo_id}.")
+        finally:
+            db.session.remove()
+
+_lock_executor = threading.Lock()
+
+def agendar_previas(anexos):
+    """Coloca a geração das prévias no pool do processo (PREVIAS_WORKERS threads). Chamar depois do commit."""
+    app = current_app._get_current_object()
+    ids = [anexo.id for anexo in anexos if suporta_previa(anexo)]
+    if not ids:
+        return
+    with _lock_executor:
+        executor = app.extensions.get('previas_executor')
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=app.config['PREVIAS_WORKERS'], thread_name_prefix='previas')
+            app.extensions['previas_executor'] = executor
+    for anexo_id in ids:
+        executor.submit(_gerar_em_segundo_plano, app, anexo_id)
+
+@anexos_cli.command('previas')
+@click.option('--refazer', is_flag=True, help='Gera de novo mesmo as prévias que já existem.')
+def previas(refazer):
+    """Gera as prévias dos anexos que ainda não têm (ex.: anexos anteriores a este recurso)."""
+    ausentes = renderizadores_ausentes()
+    for ausente in ausentes:
+        print(f"Atenção: falta {ausente}.")
+    geradas = falhas = sem_renderizador = 0
+    for anexo in Anexo.query.order_by(Anexo.id).yield_per(500):
+        if not suporta_previa(anexo):
+            if ausentes and (_mime(anexo) in MIMES_IMAGEM or _mime(anexo) == 'application/pdf'):
+                sem_renderizador += 1
+            continue
+        if previa_disponivel(anexo) and not refazer:
+            continue
+        try:
+            gerar_previas(anexo)
+            geradas += 1
+        except Exception as e:
+            falhas += 1
+            print(f"Anexo {anexo.id} ({anexo.nome_arquivo}): {e}")
+    print(f"{geradas} prévia(s) gerada(s), {falhas} falha(s).")
+    if sem_renderizador:
+        print(f"{sem_renderizador} anexo(s) ficaram sem prévia por falta de renderizador.")
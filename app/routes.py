@@ -1,17 +1,27 @@
-from flask import render_template, redirect, url_for, flash, Blueprint, request, current_app, send_from_directory, make_response, abort, send_file, jsonify
+from flask import render_template, redirect, url_for, flash, Blueprint, request, current_app, make_response, abort, send_file, jsonify, Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
 from app import db, csrf, format_datetime_local
-from app.models import Colaborador, Setor, Protocolo, Historico, Anexo, ProtocoloModelo, CampoModelo, Fornecedor, Perfil, Permissao
+from app.models import Colaborador, Setor, Protocolo, Historico, Anexo, ProtocoloModelo, CampoModelo, Fornecedor, Perfil, Permissao, ContadorProtocolo, ResumoDiarioProtocolo, NotificacaoPendente, invalidar_cache_permissoes, invalidar_cache_identidade
 from datetime import date, datetime, timedelta, timezone
 from functools import wraps
 import os 
-from werkzeug.utils import secure_filename
-from sqlalchemy import or_, func, text, literal_column
+import re
+from sqlalchemy import or_, func, text
 import sqlalchemy as sa
-from app.email import send_email
-import pandas as pd
+from app.email import notificar
+from app.numeracao import alocar_numero_protocolo, numero_provisorio, is_numero_provisorio
+from app.paginacao import paginar_keyset, contar_com_cache
+from app.busca import filtrar_por_busca, buscar_ranqueado, indexar_protocolo, remover_do_indice
+from app.carregamento import com_perfil
+from app.caixa_entrada import carregar_caixa, pagina_da_secao, SECOES as SECOES_CAIXA
+from app.contadores import chave_contador, mover_contador, registrar_criacao, registrar_exclusao
+from app.cache_respostas import resposta_versionada
+from app.armazenamento import liberar_anexos
+from app.pdf import versao_do_protocolo, obter_cache_pdf, obter_servico_pdf, invalidar_pdf
+from app.previas import agendar_previas, previa_disponivel, caminho_da_previa, TAMANHOS as TAMANHOS_PREVIA
+from app.anexos import receber_anexos, anexar, guardar_anexos, descartar, anexo_pelo_nome, resposta_de_download, AnexoRecusado
+from app.exportacao import zip_de_pdfs, planilha_de_protocolos, campos_pedidos, csv_de_protocolos, parquet_de_protocolos, suporta_parquet, csv_dos_dados_do_modelo, csv_da_auditoria
 from io import BytesIO
-from weasyprint.css import CSS
 import zlib
 import base64
 from zeep import Client, xsd 
@@ -36,7 +46,6 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SubmitField, SelectField, TextAreaField, MultipleFileField, DateField, BooleanField, SelectMultipleField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Optional, Length
 from flask import make_response
-from weasyprint import HTML
 from brazilfiscalreport.danfe import Danfe
 
 
@@ -293,6 +302,16 @@ class ChangePasswordForm(FlaskForm):
                                     validators=[DataRequired(), EqualTo('nova_senha', message='As senhas devem ser iguais.')])
     submit = SubmitField('Alterar Senha')
 
+class PreferenciasNotificacaoForm(FlaskForm):
+    intervalo_resumo = SelectField('Receber emails de notificação', coerce=int, choices=[
+        (0, 'Um email para cada evento'),
+        (15, 'Resumo a cada 15 minutos'),
+        (60, 'Resumo a cada hora'),
+        (240, 'Resumo a cada 4 horas'),
+        (1440, 'Resumo diário')
+    ])
+    submit = SubmitField('Salvar Preferência')
+
 
 class DeleteForm(FlaskForm):
     pass
@@ -328,32 +347,33 @@ def register():
 @main_bp.route('/meus-relatorios')
 @login_required
 def meus_relatorios():
-    status_pendentes = ['Aberto', 'Em Análise', 'Pendente']
-
-    # Rascunhos (Novo bloco)
-    meus_rascunhos = Protocolo.query.options(joinedload(Protocolo.modelo_usado)).filter(
-        Protocolo.criado_por_id == current_user.id,
-        Protocolo.status == 'Rascunho'
-    ).order_by(Protocolo.data_criacao.desc()).all()
+    # As seções são preenchidas pela página via api_caixa_entrada
+    return render_template('meus_relatorios.html', title="Meus Relatórios")
 
-    protocolos_enviados = Protocolo.query.options(joinedload(Protocolo.modelo_usado)).filter(
-        Protocolo.criado_por_id == current_user.id,
-        Protocolo.status.in_(status_pendentes)
-    ).order_by(Protocolo.data_criacao.desc()).all()
-
-    protocolos_recebidos = Protocolo.query.options(joinedload(Protocolo.modelo_usado)).filter(
-        or_(
-            Protocolo.setor_destinatario_id == current_user.setor_id,
-            Protocolo.colaborador_destinatario_id == current_user.id
-        ),
-        Protocolo.status.in_(status_pendentes)
-    ).order_by(Protocolo.data_criacao.desc()).all()
-
-    return render_template('meus_relatorios.html', 
-                           enviados=protocolos_enviados, 
-                           recebidos=protocolos_recebidos,
-                           rascunhos=meus_rascunhos,
-                           title="Meus Relatórios")
+@main_bp.route('/api/meus-relatorios/caixa')
+@login_required
+def api_caixa_entrada():
+    secao = request.args.get('secao')
+
+    if secao is None:
+        secoes = carregar_caixa(current_user)
+        return jsonify({'secoes': {
+            nome: {
+                'total': dados['total'],
+                'cursor': dados['cursor'],
+                'html': render_template('_caixa_entrada_linhas.html', secao=nome,
+                                        protocolos=dados['protocolos'], primeira_pagina=True)
+            } for nome, dados in secoes.items()
+        }})
+
+    if secao not in SECOES_CAIXA:
+        abort(400)
+    pagina = pagina_da_secao(current_user, secao, request.args.get('cursor'))
+    return jsonify({
+        'cursor': pagina.next_cursor,
+        'html': render_template('_caixa_entrada_linhas.html', secao=secao,
+                                protocolos=pagina.items, primeira_pagina=False)
+    })
 
 # --- ROTAS DE PROTOCOLO ---
 
@@ -376,6 +396,14 @@ def criar_protocolo():
         form.colaborador_destinatario.choices = [(0, '--- Selecione um Setor Primeiro ---')]
 
     if form.validate_on_submit():
+        # Os anexos são gravados antes de reservar o número do protocolo, para um upload recusado não gastar número
+        arquivos = [file for file in request.files.getlist(form.anexos.name) if file and allowed_file(file.filename)]
+        try:
+            anexos_recebidos = receber_anexos(arquivos)
+        except AnexoRecusado as e:
+            flash(str(e), 'danger')
+            return render_template('criar_protocolo.html', form=form, title="Novo Protocolo")
+
         lista_dados_customizados = []
         if form.modelo.data and form.modelo.data != 0:
             modelo_selecionado = ProtocoloModelo.query.get(form.modelo.data)
@@ -394,23 +422,8 @@ def criar_protocolo():
                     lista_dados_customizados.append(registro_linha)
                     i += 1
         
-        ano_atual = date.today().year
         setor_destino = Setor.query.get(form.setor_destinatario.data)
 
-        ultimo_protocolo_str = db.session.query(func.max(Protocolo.numero_protocolo)).filter(
-            Protocolo.numero_protocolo.like(f'{ano_atual}%')
-        ).scalar()
-
-        sequencial = 1
-        if ultimo_protocolo_str:
-            try:
-                ultimo_sequencial_int = int(ultimo_protocolo_str.split('-')[1])
-                sequencial = ultimo_sequencial_int + 1
-            except (IndexError, ValueError, AttributeError):
-                sequencial = 1
-                
-        numero_protocolo_gerado = f"{ano_atual:04d}-{sequencial:06d}"
-
         # LÓGICA DE STATUS E RASCUNHO
         status_inicial = 'Aberto'
         msg_historico = f"Protocolo criado e encaminhado para o setor {setor_destino.nome}."
@@ -418,6 +431,9 @@ def criar_protocolo():
         if form.submit_rascunho.data:
             status_inicial = 'Rascunho'
             msg_historico = "Protocolo salvo como rascunho."
+            numero_protocolo_gerado = numero_provisorio()
+        else:
+            numero_protocolo_gerado = alocar_numero_protocolo()
 
         novo_protocolo = Protocolo(
             numero_protocolo=numero_protocolo_gerado,
@@ -435,39 +451,34 @@ def criar_protocolo():
             status=status_inicial
         )
         
-        db.session.add(novo_protocolo)
-        
-        files = request.files.getlist(form.anexos.name)
-        for file in files:
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                db.session.flush()
-                novo_nome_arquivo = f"{novo_protocolo.id}_{filename}"
-                caminho_salvo = os.path.join(current_app.config['UPLOAD_FOLDER'], novo_nome_arquivo)
-                file.save(caminho_salvo)
-                novo_anexo = Anexo(nome_arquivo=filename, caminho_arquivo=novo_nome_arquivo, protocolo=novo_protocolo)
-                db.session.add(novo_anexo)
+        try:
+            db.session.add(novo_protocolo)
         
-        primeiro_historico = Historico(descricao=msg_historico, protocolo=novo_protocolo, colaborador_id=current_user.id)
-        db.session.add(primeiro_historico)
+            primeiro_historico = Historico(descricao=msg_historico, protocolo=novo_protocolo, colaborador_id=current_user.id)
+            db.session.add(primeiro_historico)
+            indexar_protocolo(novo_protocolo)  # único flush antes do commit: gera o id usado no nome dos anexos
+            registrar_criacao(novo_protocolo)
+            anexos_criados = anexar(novo_protocolo, anexos_recebidos)
+
+            # O email entra na fila de saída no mesmo commit do protocolo
+            if status_inicial != 'Rascunho' and novo_protocolo.colaborador_destinatario:
+                destinatario = novo_protocolo.colaborador_destinatario
+                if destinatario.email and destinatario.id != current_user.id:
+                    notificar(destinatario, 'novo_protocolo', novo_protocolo,
+                              destinatario=destinatario, remetente=current_user)
         
-        db.session.commit()
+            db.session.commit()
+        except BaseException:
+            # Nada foi para o armazenamento ainda: basta apagar os temporários
+            descartar(anexos_recebidos)
+            raise
+        guardar_anexos(anexos_recebidos)
+        agendar_previas(anexos_criados)
         
         if status_inicial == 'Rascunho':
             flash('Rascunho salvo com sucesso!', 'info')
         else:
             flash('Protocolo criado com sucesso!', 'success')
-            if novo_protocolo.colaborador_destinatario:
-                destinatario = novo_protocolo.colaborador_destinatario
-                if destinatario.email and destinatario.id != current_user.id:
-                    send_email(
-                        subject=f"Novo Protocolo Recebido: {novo_protocolo.numero_protocolo}",
-                        recipients=[destinatario.email],
-                        template='email/novo_protocolo',
-                        destinatario=destinatario,
-                        protocolo=novo_protocolo,
-                        remetente=current_user
-                    )
 
         return redirect(url_for('main.protocolo_detalhe', protocolo_id=novo_protocolo.id))
         
@@ -498,6 +509,12 @@ def editar_rascunho(protocolo_id):
     form.colaborador_destinatario.choices.insert(0, (0, '--- Nenhum ---'))
 
     if request.method == 'POST' and form.validate_on_submit():
+        # O número definitivo é reservado antes de qualquer alteração na sessão
+        numero_definitivo = None
+        if not form.submit_rascunho.data and is_numero_provisorio(protocolo.numero_protocolo):
+            numero_definitivo = alocar_numero_protocolo()
+
+        contador_anterior = chave_contador(protocolo)
         form.populate_obj(protocolo)
         
         lista_dados_customizados = []
@@ -524,6 +541,8 @@ def editar_rascunho(protocolo_id):
         else:
             protocolo.status = 'Aberto'
             protocolo.data_criacao = datetime.now() 
+            if numero_definitivo:
+                protocolo.numero_protocolo = numero_definitivo
             
             hist = Historico(descricao="Rascunho finalizado e enviado.", protocolo=protocolo, colaborador_id=current_user.id)
             db.session.add(hist)
@@ -533,15 +552,11 @@ def editar_rascunho(protocolo_id):
             if protocolo.colaborador_destinatario:
                  destinatario = protocolo.colaborador_destinatario
                  if destinatario.email and destinatario.id != current_user.id:
-                    send_email(
-                        subject=f"Novo Protocolo Recebido: {protocolo.numero_protocolo}",
-                        recipients=[destinatario.email],
-                        template='email/novo_protocolo',
-                        destinatario=destinatario,
-                        protocolo=protocolo,
-                        remetente=current_user
-                    )
+                    notificar(destinatario, 'novo_protocolo', protocolo,
+                              destinatario=destinatario, remetente=current_user)
 
+        indexar_protocolo(protocolo)
+        mover_contador(contador_anterior, chave_contador(protocolo))
         db.session.commit()
         return redirect(url_for('main.protocolo_detalhe', protocolo_id=protocolo.id))
 
@@ -558,6 +573,10 @@ def excluir_protocolo(protocolo_id):
         return redirect(url_for('main.index'))
     
     try:
+        remover_do_indice(protocolo.id)
+        registrar_exclusao(protocolo)
+        liberar_anexos(protocolo.anexos)
+        NotificacaoPendente.query.filter_by(protocolo_id=protocolo.id).delete(synchronize_session=False)
         db.session.delete(protocolo)
         db.session.commit()
         flash('Rascunho excluído com sucesso.', 'success')
@@ -570,7 +589,7 @@ def excluir_protocolo(protocolo_id):
 @main_bp.route('/protocolo/<int:protocolo_id>')
 @login_required
 def protocolo_detalhe(protocolo_id):
-    protocolo = Protocolo.query.get_or_404(protocolo_id)
+    protocolo = com_perfil(Protocolo.query, 'detail').get_or_404(protocolo_id)
     
     if not current_user.tem_permissao('acessar_painel_admin') and \
    protocolo.criado_por_id != current_user.id and \
@@ -580,7 +599,8 @@ def protocolo_detalhe(protocolo_id):
             
     form = DespachoForm()
     form.novo_status.data = protocolo.status
-    return render_template('protocolo_detalhe.html', protocolo=protocolo, form=form)
+    previas = {anexo.id for anexo in protocolo.anexos if previa_disponivel(anexo)}
+    return render_template('protocolo_detalhe.html', protocolo=protocolo, form=form, previas=previas)
 
 
 
@@ -597,27 +617,25 @@ def tramitar_protocolo(protocolo_id):
 
     form = DespachoForm()
     if form.validate_on_submit():
+        contador_anterior = chave_contador(protocolo)
         protocolo.status = form.novo_status.data
+        mover_contador(contador_anterior, chave_contador(protocolo))
         novo_historico = Historico(
             descricao=form.descricao.data,
             protocolo_id=protocolo.id,
             colaborador_id=current_user.id
         )
         db.session.add(novo_historico)
-        db.session.commit()
-        flash('Protocolo atualizado com sucesso.', 'success')
 
         if protocolo.criado_por.email and protocolo.criado_por_id != current_user.id:
-            send_email(
-                subject=f"Atualização no Protocolo {protocolo.numero_protocolo}",
-                recipients=[protocolo.criado_por.email],
-                template='email/status_update',
-                criador=protocolo.criado_por,
-                protocolo=protocolo,
-                novo_status=protocolo.status,
-                despacho=form.descricao.data,
-                autor_despacho=current_user.nome
-            )
+            notificar(protocolo.criado_por, 'status_update', protocolo,
+                      criador=protocolo.criado_por,
+                      novo_status=protocolo.status,
+                      despacho=form.descricao.data,
+                      autor_despacho=current_user.nome)
+        db.session.commit()
+        invalidar_pdf(protocolo.id)
+        flash('Protocolo atualizado com sucesso.', 'success')
     else:
         flash('Ocorreu um erro na validação. O campo de despacho não pode estar em branco.', 'danger')
 
@@ -626,7 +644,36 @@ def tramitar_protocolo(protocolo_id):
 @main_bp.route('/uploads/<path:filename>')
 @login_required
 def download_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    # Só entrega anexos cadastrados: a pasta de uploads também guarda o armazenamento por
+    # conteúdo, os temporários dos uploads e as prévias, que não podem ser pedidos direto
+    anexo = anexo_pelo_nome(filename)
+    if anexo is None:
+        abort(404)
+    if not _pode_ver_protocolo(anexo.protocolo):
+        abort(403)
+    return resposta_de_download(anexo)
+
+@main_bp.route('/anexo/<int:anexo_id>/<tipo>')
+@login_required
+def previa_anexo(anexo_id, tipo):
+    if tipo not in TAMANHOS_PREVIA:
+        abort(404)
+    anexo = Anexo.query.get_or_404(anexo_id)
+    protocolo = anexo.protocolo
+    if not current_user.tem_permissao('acessar_painel_admin') and \
+   protocolo.criado_por_id != current_user.id and \
+   protocolo.setor_destinatario_id != current_user.setor_id and \
+   protocolo.colaborador_destinatario_id != current_user.id:
+        abort(403)
+
+    caminho = caminho_da_previa(anexo, tipo)
+    if not os.path.exists(caminho):
+        abort(404)
+    # A prévia de um conteúdo nunca muda, então o navegador pode reaproveitá-la sem revalidar
+    resposta = send_file(caminho, mimetype='image/jpeg', etag=f"{anexo.sha256 or anexo.id}-{tipo}", max_age=86400)
+    resposta.cache_control.private = True
+    resposta.cache_control.public = False
+    return resposta
 
 # --- ROTAS DE ADMINISTRAÇÃO ---
 
@@ -653,6 +700,7 @@ def adicionar_perfil():
         novo_perfil.permissoes = permissoes_selecionadas
         db.session.add(novo_perfil)
         db.session.commit()
+        invalidar_cache_permissoes(novo_perfil.id)
         flash('Perfil criado com sucesso!', 'success')
         return redirect(url_for('main.listar_perfis'))
     elif request.method == 'POST':
@@ -673,6 +721,8 @@ def editar_perfil(perfil_id):
         permissoes_selecionadas = Permissao.query.filter(Permissao.id.in_(form.permissoes.data)).all()
         perfil.permissoes = permissoes_selecionadas
         db.session.commit()
+        invalidar_cache_permissoes(perfil.id)
+        invalidar_cache_identidade()
         flash('Perfil atualizado com sucesso!', 'success')
         return redirect(url_for('main.listar_perfis'))
     elif request.method == 'GET':
@@ -882,6 +932,7 @@ def editar_colaborador(colab_id):
         if form.password.data:
             colaborador.senha = form.password.data
         db.session.commit()
+        invalidar_cache_identidade(colaborador.id)
         flash('Colaborador atualizado com sucesso!', 'success')
         return redirect(url_for('main.listar_colaboradores'))
     elif request.method == 'GET':
@@ -902,8 +953,11 @@ def excluir_colaborador(colab_id):
     if colaborador.protocolos_criados or colaborador.historicos_criados:
         flash('Este colaborador não pode ser excluído pois possui protocolos ou históricos associados.', 'danger')
     else:
+        # Eventos ainda não enviados no resumo deixam de ter destinatário
+        NotificacaoPendente.query.filter_by(colaborador_id=colaborador.id).delete(synchronize_session=False)
         db.session.delete(colaborador)
         db.session.commit()
+        invalidar_cache_identidade(colab_id)
         flash('Colaborador excluído com sucesso!', 'success')
     return redirect(url_for('main.listar_colaboradores'))
 
@@ -1049,33 +1103,23 @@ def get_campos_modelo(modelo_id):
     return jsonify(campos_schema)
 
 
-@main_bp.route('/')
-@main_bp.route('/index')
-@login_required
-def index():
-    view_mode = request.args.get('view', 'list')
-
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 25, type=int)
-    if per_page not in [10, 25, 50]: per_page = 25
+# Colunas do quadro Kanban e quantos cards cada uma carrega por vez
+STATUS_KANBAN = ['Aberto', 'Em Análise', 'Pendente', 'Finalizado', 'Arquivado']
+KANBAN_CARDS_POR_COLUNA = 20
 
-    form = BuscaProtocoloForm(request.args)
-    
-    form.modelo.choices = [(m.id, m.nome) for m in ProtocoloModelo.query.order_by('nome').all()]
-    form.modelo.choices.insert(0, (0, 'Todos os Modelos'))
-    
+def _consulta_dashboard(form):
+    """Consulta dos protocolos visíveis ao usuário atual com os filtros do dashboard aplicados."""
     if current_user.tem_permissao('acessar_painel_admin'):
-        query = Protocolo.query.options(joinedload(Protocolo.modelo_usado))
+        query = Protocolo.query
     else:
         query = Protocolo.query.filter(or_(
             Protocolo.criado_por_id == current_user.id,
             Protocolo.setor_destinatario_id == current_user.setor_id,
             Protocolo.colaborador_destinatario_id == current_user.id
-        )).options(joinedload(Protocolo.modelo_usado))
+        ))
     
     if form.termo_busca.data:
-        termo = f"%{form.termo_busca.data}%"
-        query = query.filter(or_(Protocolo.assunto.ilike(termo), Protocolo.descricao.ilike(termo), Protocolo.numero_protocolo.ilike(termo)))
+        query = filtrar_por_busca(query, form.termo_busca.data)
     
     if form.modelo.data and form.modelo.data != 0:
         query = query.filter(Protocolo.modelo_usado_id == form.modelo.data)
@@ -1088,30 +1132,90 @@ def index():
         from datetime import datetime, time
         data_fim_completa = datetime.combine(form.data_fim.data, time.max)
         query = query.filter(Protocolo.data_criacao <= data_fim_completa)
+    return query
+
+def _totais_kanban(query):
+    """Totais de todas as colunas do kanban em um único GROUP BY."""
+    return dict(query.with_entities(Protocolo.status, func.count(Protocolo.id)).group_by(Protocolo.status).all())
+
+def _coluna_kanban(query, status, cursor=None):
+    """Uma leva de cards de uma coluna do kanban."""
+    return paginar_keyset(com_perfil(query.filter(Protocolo.status == status), 'kanban'), KANBAN_CARDS_POR_COLUNA, cursor)
+
+def _pagina_dashboard(query, modo_paginacao, page, per_page, cursor=None, total=None):
+    """Página da listagem do dashboard, por cursor (keyset) ou por OFFSET."""
+    if modo_paginacao == 'cursor':
+        return paginar_keyset(com_perfil(query, 'list'), per_page, cursor, total=total)
+    return com_perfil(query, 'list').order_by(Protocolo.data_criacao.desc()).paginate(
+        page=page, per_page=per_page, error_out=False
+    )
+
+@main_bp.route('/')
+@main_bp.route('/index')
+@login_required
+def index():
+    view_mode = request.args.get('view', 'list')
+    modo_paginacao = request.args.get('paginacao', current_app.config['DASHBOARD_PAGINACAO'])
+
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 25, type=int)
+    if per_page not in [10, 25, 50]: per_page = 25
+
+    form = BuscaProtocoloForm(request.args)
+    
+    form.modelo.choices = [(m.id, m.nome) for m in ProtocoloModelo.query.order_by('nome').all()]
+    form.modelo.choices.insert(0, (0, 'Todos os Modelos'))
+    
+    query = _consulta_dashboard(form)
 
     protocolos_agrupados = None
     pagination = None
 
     if view_mode == 'kanban':
-        protocolos_filtrados = query.order_by(Protocolo.data_criacao.desc()).all()
-        protocolos_agrupados = {
-            'Aberto': [], 'Em Análise': [], 'Pendente': [], 'Finalizado': [], 'Arquivado': []
-        }
-        for p in protocolos_filtrados:
-            if p.status in protocolos_agrupados:
-                protocolos_agrupados[p.status].append(p)
+        # Totais de todas as colunas em um único GROUP BY; cada coluna busca só a primeira leva de cards
+        totais = _totais_kanban(query)
+        protocolos_agrupados = {}
+        for status in STATUS_KANBAN:
+            coluna = _coluna_kanban(query, status) if totais.get(status) else None
+            protocolos_agrupados[status] = {
+                'protocolos': coluna.items if coluna else [],
+                'total': totais.get(status, 0),
+                'cursor': coluna.next_cursor if coluna else None
+            }
+    elif modo_paginacao == 'cursor':
+        total = None
+        ttl_contagem = current_app.config['DASHBOARD_CONTAGEM_TTL']
+        if ttl_contagem:
+            escopo = 'admin' if current_user.tem_permissao('acessar_painel_admin') else current_user.id
+            filtros = tuple(sorted((k, v) for k, v in request.args.items() if k not in ('cursor', 'page', 'per_page')))
+            total = contar_com_cache(('index', escopo, filtros), query, ttl_contagem)
+        pagination = _pagina_dashboard(query, modo_paginacao, page, per_page, request.args.get('cursor'), total=total)
     else: # O modo padrão é 'list'
-        pagination = query.order_by(Protocolo.data_criacao.desc()).paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+        pagination = _pagina_dashboard(query, modo_paginacao, page, per_page)
 
     return render_template('dashboard.html', 
                            protocolos=pagination.items if pagination else [], 
                            form=form, 
                            pagination=pagination,
                            view_mode=view_mode,
+                           modo_paginacao=modo_paginacao,
                            protocolos_agrupados=protocolos_agrupados)
 
+@main_bp.route('/api/kanban/coluna')
+@login_required
+def api_kanban_coluna():
+    status = request.args.get('coluna')
+    if status not in STATUS_KANBAN:
+        abort(400)
+
+    form = BuscaProtocoloForm(request.args)
+    coluna = _coluna_kanban(_consulta_dashboard(form), status, request.args.get('cursor'))
+
+    return jsonify({
+        'html': render_template('_kanban_cards.html', protocolos=coluna.items),
+        'cursor': coluna.next_cursor
+    })
+
 
 @main_bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -1129,6 +1233,31 @@ def login():
             flash('Login falhou. Verifique seu email e senha.', 'danger')
     return render_template('login.html', form=form)
 
+@main_bp.route('/api/protocolos/busca')
+@login_required
+def api_buscar_protocolos():
+    termo = request.args.get('q', '').strip()
+    if not termo:
+        return jsonify([])
+
+    if current_user.tem_permissao('acessar_painel_admin'):
+        query = Protocolo.query
+    else:
+        query = Protocolo.query.filter(or_(
+            Protocolo.criado_por_id == current_user.id,
+            Protocolo.setor_destinatario_id == current_user.setor_id,
+            Protocolo.colaborador_destinatario_id == current_user.id
+        ))
+
+    resultados = buscar_ranqueado(query, termo, limite=20)
+    return jsonify([{
+        'id': p.id,
+        'numero_protocolo': p.numero_protocolo,
+        'assunto': p.assunto,
+        'status': p.status,
+        'url': url_for('main.protocolo_detalhe', protocolo_id=p.id)
+    } for p in resultados])
+
 @main_bp.route('/api/setor/<int:setor_id>/colaboradores')
 @login_required
 def get_colaboradores_por_setor(setor_id):
@@ -1175,112 +1304,239 @@ def api_buscar_fornecedores():
 
     return jsonify(results)
 
+def _pode_ver_protocolo(protocolo):
+    return current_user.tem_permissao('acessar_painel_admin') or \
+        protocolo.criado_por_id == current_user.id or \
+        protocolo.setor_destinatario_id == current_user.setor_id or \
+        protocolo.colaborador_destinatario_id == current_user.id
+
+def _resposta_pdf(protocolo, caminho, versao):
+    response = send_file(caminho, mimetype='application/pdf', etag=versao,
+                         download_name=f'protocolo_{protocolo.numero_protocolo}.pdf')
+    response.headers['Content-Disposition'] = f'inline; filename=protocolo_{protocolo.numero_protocolo}.pdf'
+    response.cache_control.private = True
+    return response
+
+def _submeter_pdf(protocolo):
+    """Coloca a renderização no pool de processos (ou acha o PDF no cache) e devolve o id do job."""
+    html_renderizado = render_template('pdf/protocolo_pdf.html', protocolo=protocolo)
+    return obter_servico_pdf().submeter(protocolo.id, versao_do_protocolo(protocolo), html_renderizado, request.url_root)
+
+def _protocolo_do_job(job_id):
+    """Valida o id do job ('<protocolo_id>-<versao>') e aplica as regras de acesso do protocolo."""
+    if not re.fullmatch(r'\d+-[0-9a-f]{40}', job_id):
+        abort(404)
+    protocolo = Protocolo.query.get_or_404(int(job_id.split('-', 1)[0]))
+    if not _pode_ver_protocolo(protocolo):
+        abort(403)
+    return protocolo
+
 @main_bp.route('/protocolo/<int:protocolo_id>/pdf')
 @login_required
 def gerar_protocolo_pdf(protocolo_id):
     protocolo = Protocolo.query.get_or_404(protocolo_id)
     
-    if not current_user.tem_permissao('acessar_painel_admin') and \
-       protocolo.criado_por_id != current_user.id and \
-       protocolo.setor_destinatario_id != current_user.setor_id and \
-       protocolo.colaborador_destinatario_id != current_user.id:
+    if not _pode_ver_protocolo(protocolo):
         abort(403)
 
-    html_renderizado = render_template('pdf/protocolo_pdf.html', protocolo=protocolo)
-    
-    css_string = '@page { size: A4 landscape; margin: 1.5cm; }'
-    pdf_css = CSS(string=css_string)
+    versao = versao_do_protocolo(protocolo)
+    caminho = obter_cache_pdf().get(protocolo.id, versao)
+    if caminho is None:
+        # A renderização roda no pool de processos; esta thread só espera (até PDF_TIMEOUT)
+        caminho = obter_servico_pdf().aguardar(_submeter_pdf(protocolo))
+        if caminho is None:
+            abort(503)
     
-    pdf = HTML(string=html_renderizado, base_url=request.url_root).write_pdf(stylesheets=[pdf_css])
-    
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'inline; filename=protocolo_{protocolo.numero_protocolo}.pdf'
-    
-    return response
+    return _resposta_pdf(protocolo, caminho, versao)
+
+@main_bp.route('/protocolo/<int:protocolo_id>/pdf/job', methods=['POST'])
+@login_required
+def api_pdf_submeter(protocolo_id):
+    protocolo = Protocolo.query.get_or_404(protocolo_id)
+    if not _pode_ver_protocolo(protocolo):
+        abort(403)
+
+    job_id = _submeter_pdf(protocolo)
+    status, erro = obter_servico_pdf().status(job_id)
+    return jsonify({
+        'job_id': job_id,
+        'status': status,
+        'erro': erro,
+        'status_url': url_for('main.api_pdf_status', job_id=job_id),
+        'resultado_url': url_for('main.api_pdf_resultado', job_id=job_id)
+    }), 202
+
+@main_bp.route('/pdf/job/<job_id>')
+@login_required
+def api_pdf_status(job_id):
+    _protocolo_do_job(job_id)
+    status, erro = obter_servico_pdf().status(job_id)
+    return jsonify({'job_id': job_id, 'status': status, 'erro': erro})
+
+@main_bp.route('/pdf/job/<job_id>/resultado')
+@login_required
+def api_pdf_resultado(job_id):
+    protocolo = _protocolo_do_job(job_id)
+    versao = job_id.split('-', 1)[1]
+    caminho = obter_cache_pdf().get(protocolo.id, versao)
+    if caminho is None:
+        abort(404)
+    return _resposta_pdf(protocolo, caminho, versao)
 
 # --- ROTA PARA EXPORTAÇÃO EM EXCEL ---
 @main_bp.route('/exportar/excel')
 @login_required
 def exportar_excel():
-    if current_user.role == 'admin':
-        query = Protocolo.query
-    else:
-        query = Protocolo.query.filter(or_(
-            Protocolo.criado_por_id == current_user.id,
-            Protocolo.setor_destinatario_id == current_user.setor_id,
-            Protocolo.colaborador_destinatario_id == current_user.id
-        ))
-    
-    args = request.args
-    if args.get('termo_busca'):
-        termo = f"%{args.get('termo_busca')}%"
-        query = query.filter(or_(Protocolo.assunto.ilike(termo), Protocolo.descricao.ilike(termo), Protocolo.numero_protocolo.ilike(termo)))
-    if args.get('status'):
-        query = query.filter(Protocolo.status == args.get('status'))
-    if args.get('data_inicio'):
-        query = query.filter(Protocolo.data_criacao >= args.get('data_inicio'))
-    if args.get('data_fim'):
-        from datetime import datetime, time
-        data_fim_obj = datetime.strptime(args.get('data_fim'), '%Y-%m-%d')
-        data_fim_completa = datetime.combine(data_fim_obj, time.max)
-        query = query.filter(Protocolo.data_criacao <= data_fim_completa)
-
-    protocolos = query.order_by(Protocolo.data_criacao.desc()).all()
-    
-    dados_para_excel = []
-    for p in protocolos:
-        dados_para_excel.append({
-            'Número Protocolo': p.numero_protocolo,
-            'Status': p.status,
-            'Assunto': p.assunto,
-            'Criado Por': p.criado_por.nome,
-            'Data Criação': p.data_criacao.strftime('%d/%m/%Y %H:%M'),
-            'Setor Destino': p.setor_destinatario.nome,
-            'Destinatário Específico': p.colaborador_destinatario.nome if p.colaborador_destinatario else ''
-        })
-        
-    df = pd.DataFrame(dados_para_excel)
-    
-    output = BytesIO()
-    df.to_excel(output, index=False, sheet_name='Protocolos')
-    output.seek(0)
-    
+    form = BuscaProtocoloForm(request.args)
     return send_file(
-        output,
+        planilha_de_protocolos(_consulta_dashboard(form)),
         download_name="relatorio_protocolos.xlsx",
         as_attachment=True,
         mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
     )
 
+# --- EXPORTAÇÃO EM CSV / PARQUET (para as cargas de BI) ---
+@main_bp.route('/exportar/<any(csv, parquet):formato>')
+@login_required
+def exportar_dados(formato):
+    """
+    Protocolos do dashboard (mesmos filtros) em CSV, opcionalmente com gzip=1, ou Parquet,
+    enviados enquanto são lidos do banco. fields=numero_protocolo,status,... escolhe as colunas.
+    """
+    try:
+        campos = campos_pedidos(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query = _consulta_dashboard(BuscaProtocoloForm(request.args))
+    if formato == 'parquet':
+        if not suporta_parquet():
+            return jsonify({'error': 'Exportação em Parquet indisponível: o pyarrow não está instalado.'}), 501
+        conteudo, mimetype, nome = parquet_de_protocolos(query, campos), 'application/vnd.apache.parquet', 'protocolos.parquet'
+    elif request.args.get('gzip') in ('1', 'true'):
+        conteudo, mimetype, nome = csv_de_protocolos(query, campos, comprimir=True), 'application/gzip', 'protocolos.csv.gz'
+    else:
+        conteudo, mimetype, nome = csv_de_protocolos(query, campos), 'text/csv', 'protocolos.csv'
+
+    response = Response(stream_with_context(conteudo), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={nome}'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@main_bp.route('/exportar/modelo/<int:modelo_id>')
+@login_required
+def exportar_dados_modelo(modelo_id):
+    """As linhas preenchidas de todos os protocolos do modelo (visíveis ao usuário, com os filtros do dashboard) em CSV."""
+    modelo = ProtocoloModelo.query.get_or_404(modelo_id)
+    query = _consulta_dashboard(BuscaProtocoloForm(request.args))
+
+    response = Response(stream_with_context(csv_dos_dados_do_modelo(query, modelo)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=modelo_{modelo.id}_dados.csv'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- EXPORTAÇÃO DOS PDFS EM LOTE (ZIP) ---
+@main_bp.route('/exportar/pdf')
+@login_required
+def exportar_pdfs():
+    """PDF de cada protocolo que o dashboard mostra com os filtros atuais, num ZIP enviado enquanto é gerado."""
+    form = BuscaProtocoloForm(request.args)
+    ids = [id_ for (id_,) in _consulta_dashboard(form).with_entities(Protocolo.id).order_by(Protocolo.data_criacao.desc()).all()]
+
+    limite = current_app.config['EXPORTACAO_PDF_LIMITE']
+    if not ids or len(ids) > limite:
+        if ids:
+            flash(f'A exportação em PDF é limitada a {limite} protocolos ({len(ids)} encontrados). Refine os filtros.', 'warning')
+        else:
+            flash('Nenhum protocolo encontrado com os filtros informados.', 'info')
+        return redirect(url_for('main.index', **request.args))
+
+    response = Response(stream_with_context(zip_de_pdfs(ids)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = 'attachment; filename=protocolos_pdf.zip'
+    response.headers['X-Accel-Buffering'] = 'no'  # o nginx repassa os pedaços sem acumular
+    return response
+
 # --- ROTAS DE API PARA RELATÓRIOS ---
 
+# Rótulo do período de cada dia: o próprio dia, a segunda-feira da semana ou o mês
+GRANULARIDADES_SERIE = {
+    'dia': lambda dia: dia.isoformat(),
+    'semana': lambda dia: (dia - timedelta(days=dia.weekday())).isoformat(),
+    'mes': lambda dia: dia.strftime('%Y-%m'),
+}
+
+def _consulta_protocolos_por_dia(inicio, fim, setor_id=None, modelo_id=None, status=None):
+    """Protocolos criados por dia no período, lidos do resumo diário."""
+    total = func.sum(ResumoDiarioProtocolo.total)
+    query = db.session.query(ResumoDiarioProtocolo.dia, total.label('total')).filter(
+        ResumoDiarioProtocolo.dia >= inicio, ResumoDiarioProtocolo.dia <= fim
+    )
+    if setor_id:
+        query = query.filter(ResumoDiarioProtocolo.setor_id == setor_id)
+    if modelo_id is not None:
+        query = query.filter(ResumoDiarioProtocolo.modelo_id == modelo_id)
+    if status:
+        query = query.filter(ResumoDiarioProtocolo.status == status)
+    return query.group_by(ResumoDiarioProtocolo.dia).having(total != 0)
+
+def _consulta_protocolos_por_status():
+    total = func.sum(ContadorProtocolo.total)
+    return db.session.query(
+        ContadorProtocolo.status,
+        total.label('total')
+    ).group_by(ContadorProtocolo.status).having(total > 0).order_by(total.desc())
+
+def _consulta_protocolos_por_setor():
+    total = func.sum(ContadorProtocolo.total)
+    return db.session.query(
+        Setor.nome,
+        total.label('total')
+    ).join(ContadorProtocolo, Setor.id == ContadorProtocolo.setor_id).group_by(Setor.nome).having(total > 0).order_by(total.desc())
+
 @main_bp.route('/api/relatorios/protocolos_por_mes')
 @login_required
 @permission_required('acessar_painel_admin')
+@resposta_versionada
 def api_protocolos_por_mes():
-    doze_meses_atras = datetime.utcnow() - timedelta(days=365)
-    
-    mes_expression = literal_column("FORMAT(data_criacao, 'yyyy-MM')")
-    
-    dados = db.session.query(
-        mes_expression.label('mes'),
-        func.count(Protocolo.id).label('total')
-    ).filter(Protocolo.data_criacao >= doze_meses_atras).group_by(mes_expression).order_by(mes_expression).all()
-    
-    labels = [dado.mes for dado in dados]
-    data = [dado.total for dado in dados]
-    
+    """
+    Série temporal de protocolos criados, lida do resumo diário.
+    Parâmetros: inicio/fim (AAAA-MM-DD, padrão últimos 12 meses), granularidade
+    (dia, semana ou mes) e filtros opcionais setor_id, modelo_id e status.
+    """
+    try:
+        fim = date.fromisoformat(request.args['fim']) if request.args.get('fim') else date.today()
+        inicio = date.fromisoformat(request.args['inicio']) if request.args.get('inicio') else fim - timedelta(days=365)
+    except ValueError:
+        return jsonify({'error': 'Datas devem estar no formato AAAA-MM-DD.'}), 400
+    granularidade = request.args.get('granularidade', 'mes')
+    if granularidade not in GRANULARIDADES_SERIE or inicio > fim:
+        return jsonify({'error': 'Parâmetros inválidos.'}), 400
+
+    query = _consulta_protocolos_por_dia(
+        inicio, fim,
+        setor_id=request.args.get('setor_id', type=int),
+        modelo_id=request.args.get('modelo_id', type=int),
+        status=request.args.get('status')
+    )
+
+    # Agrupa por dia no banco e junta em semanas/meses aqui: no máximo algumas centenas de linhas
+    rotulo = GRANULARIDADES_SERIE[granularidade]
+    series = {}
+    for dado in query.all():
+        chave = rotulo(dado.dia)
+        series[chave] = series.get(chave, 0) + dado.total
+
+    labels = sorted(series)
+    data = [series[label] for label in labels]
+
     return jsonify({'labels': labels, 'data': data})
 
 @main_bp.route('/api/relatorios/protocolos_por_status')
 @login_required
 @permission_required('acessar_painel_admin')
+@resposta_versionada
 def api_protocolos_por_status():
-    dados = db.session.query(
-        Protocolo.status,
-        func.count(Protocolo.id).label('total')
-    ).group_by(Protocolo.status).order_by(func.count(Protocolo.id).desc()).all()
+    dados = _consulta_protocolos_por_status().all()
     
     labels = [dado.status for dado in dados]
     data = [dado.total for dado in dados]
@@ -1290,11 +1546,9 @@ def api_protocolos_por_status():
 @main_bp.route('/api/relatorios/protocolos_por_setor')
 @login_required
 @permission_required('acessar_painel_admin')
+@resposta_versionada
 def api_protocolos_por_setor():
-    dados = db.session.query(
-        Setor.nome,
-        func.count(Protocolo.id).label('total')
-    ).join(Protocolo, Setor.id == Protocolo.setor_destinatario_id).group_by(Setor.nome).order_by(func.count(Protocolo.id).desc()).all()
+    dados = _consulta_protocolos_por_setor().all()
 
     labels = [dado.nome for dado in dados]
     data = [dado.total for dado in dados]
@@ -1302,6 +1556,27 @@ def api_protocolos_por_setor():
     return jsonify({'labels': labels, 'data': data})
 
 
+def _filtros_auditoria(form):
+    """Condições dos filtros da trilha de auditoria. O filtro por número exige o JOIN com Protocolo."""
+    filtros = []
+    if form.protocolo_numero.data:
+        filtros.append(Protocolo.numero_protocolo.ilike(f"%{form.protocolo_numero.data}%"))
+    if form.colaborador.data and form.colaborador.data != 0:
+        filtros.append(Historico.colaborador_id == form.colaborador.data)
+    if form.data_inicio.data:
+        filtros.append(Historico.data_ocorrencia >= form.data_inicio.data)
+    if form.data_fim.data:
+        from datetime import datetime, time
+        filtros.append(Historico.data_ocorrencia <= datetime.combine(form.data_fim.data, time.max))
+    return filtros
+
+def _consulta_auditoria(form):
+    """Trilha de auditoria filtrada, mais recente primeiro."""
+    query = Historico.query
+    if form.protocolo_numero.data:
+        query = query.join(Protocolo)
+    return query.filter(*_filtros_auditoria(form)).order_by(Historico.data_ocorrencia.desc())
+
 @main_bp.route('/admin/relatorios/auditoria')
 @login_required
 @permission_required('acessar_painel_admin')
@@ -1313,23 +1588,7 @@ def relatorio_auditoria():
     form.colaborador.choices = [(c.id, c.nome) for c in Colaborador.query.order_by(Colaborador.nome).all()]
     form.colaborador.choices.insert(0, (0, 'Todos os Colaboradores'))
 
-    query = Historico.query
-
-    if form.protocolo_numero.data:
-        query = query.join(Protocolo).filter(Protocolo.numero_protocolo.ilike(f"%{form.protocolo_numero.data}%"))
-
-    if form.colaborador.data and form.colaborador.data != 0:
-        query = query.filter(Historico.colaborador_id == form.colaborador.data)
-
-    if form.data_inicio.data:
-        query = query.filter(Historico.data_ocorrencia >= form.data_inicio.data)
-
-    if form.data_fim.data:
-        from datetime import datetime, time
-        data_fim_completa = datetime.combine(form.data_fim.data, time.max)
-        query = query.filter(Historico.data_ocorrencia <= data_fim_completa)
-
-    pagination = query.order_by(Historico.data_ocorrencia.desc()).paginate(
+    pagination = _consulta_auditoria(form).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
@@ -1339,6 +1598,17 @@ def relatorio_auditoria():
                            title="Trilha de Auditoria")
 
 
+@main_bp.route('/admin/relatorios/auditoria/exportar')
+@login_required
+@permission_required('acessar_painel_admin')
+def exportar_auditoria():
+    """Toda a trilha de auditoria filtrada (mesmos filtros da tela) em CSV, enviada enquanto é lida."""
+    form = AuditoriaForm(request.args)
+    response = Response(stream_with_context(csv_da_auditoria(_filtros_auditoria(form))), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=trilha_auditoria.csv'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @main_bp.route('/minha-conta', methods=['GET', 'POST'])
 @login_required
 def minha_conta():
@@ -1347,12 +1617,25 @@ def minha_conta():
         if current_user.verificar_senha(form.senha_atual.data):
             current_user.senha = form.nova_senha.data
             db.session.commit()
+            invalidar_cache_identidade(current_user.id)
             flash('Sua senha foi alterada com sucesso!', 'success')
             return redirect(url_for('main.minha_conta'))
         else:
             flash('Senha atual incorreta.', 'danger')
 
-    return render_template('minha_conta.html', title="Minha Conta", form=form)
+    form_notificacoes = PreferenciasNotificacaoForm(intervalo_resumo=current_user.intervalo_resumo)
+    return render_template('minha_conta.html', title="Minha Conta", form=form, form_notificacoes=form_notificacoes)
+
+@main_bp.route('/minha-conta/notificacoes', methods=['POST'])
+@login_required
+def preferencias_notificacao():
+    form = PreferenciasNotificacaoForm()
+    if form.validate_on_submit():
+        current_user.intervalo_resumo = form.intervalo_resumo.data
+        db.session.commit()
+        invalidar_cache_identidade(current_user.id)
+        flash('Preferência de notificação salva.', 'success')
+    return redirect(url_for('main.minha_conta'))
 
 
 @main_bp.route('/api/protocolo/update_status', methods=['POST'])
@@ -1371,7 +1654,9 @@ def api_update_protocolo_status():
    protocolo.colaborador_destinatario_id != current_user.id:
         abort(403)
 
+    contador_anterior = chave_contador(protocolo)
     protocolo.status = novo_status
+    mover_contador(contador_anterior, chave_contador(protocolo))
 
     novo_historico = Historico(
         descricao=f"Status alterado para '{novo_status}' através do quadro Kanban.",
@@ -1380,6 +1665,7 @@ def api_update_protocolo_status():
     )
     db.session.add(novo_historico)
     db.session.commit()
+    invalidar_pdf(protocolo.id)
 
     return jsonify({'success': True, 'message': 'Status atualizado com sucesso.'})
 
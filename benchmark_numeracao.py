@@ -0,0 +1,133 @@
+"""
+Benchmark de concorrência da numeração de protocolos.
+
+Dispara várias rodadas de criações paralelas (alocação do número + INSERT em Protocolo)
+e verifica que nenhum número foi repetido e que a latência não cresce junto com a tabela:
+depois da primeira rodada a tabela recebe --semear protocolos de uma vez, e o teste falha
+se o p50 de alguma rodada seguinte passar de --fator-maximo vezes o p50 da primeira.
+
+ATENÇÃO: grava protocolos de verdade no banco configurado. Rode contra uma base de
+homologação, apontando DB_SERVER/DB_NAME no .env, ou informe --database-url.
+
+Uso:
+    python benchmark_numeracao.py --rodadas 5 --por-rodada 200 --paralelos 32 --semear 50000
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app, db
+from app.models import Colaborador, Protocolo, Setor
+from app.numeracao import alocar_numero_protocolo, reservar_numeros
+from config import Config
+
+
+def criar_protocolo_benchmark(app, setor_id, colaborador_id, indice):
+    with app.app_context():
+        inicio = time.perf_counter()
+        numero = alocar_numero_protocolo()
+        db.session.add(Protocolo(
+            numero_protocolo=numero,
+            assunto=f"Benchmark de numeração #{indice}",
+            descricao='',
+            criado_por_id=colaborador_id,
+            setor_destinatario_id=setor_id,
+            status='Aberto'
+        ))
+        db.session.commit()
+        return numero, time.perf_counter() - inicio
+
+
+def semear_protocolos(app, setor_id, colaborador_id, quantidade, lote=1000):
+    """Insere `quantidade` protocolos em lotes, para as rodadas seguintes medirem a alocação com a tabela maior."""
+    with app.app_context():
+        tabela = Protocolo.__table__
+        while quantidade > 0:
+            numeros = reservar_numeros(min(lote, quantidade))
+            db.session.execute(tabela.insert(), [{
+                'numero_protocolo': numero,
+                'assunto': 'Benchmark de numeração (carga)',
+                'descricao': '',
+                'criado_por_id': colaborador_id,
+                'setor_destinatario_id': setor_id,
+                'status': 'Aberto',
+                'is_externo': False
+            } for numero in numeros])
+            db.session.commit()
+            quantidade -= len(numeros)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rodadas', type=int, default=5)
+    parser.add_argument('--por-rodada', type=int, default=200)
+    parser.add_argument('--paralelos', type=int, default=32)
+    parser.add_argument('--database-url', help='URL SQLAlchemy do banco de testes (padrão: a do .env)')
+    parser.add_argument('--semear', type=int, default=20000, help='Protocolos inseridos entre a 1ª e a 2ª rodada')
+    parser.add_argument('--fator-maximo', type=float, default=2.0, help='Maior razão aceita entre o p50 de uma rodada e o da 1ª')
+    parser.add_argument('--manter', action='store_true', help='Não apaga os protocolos criados ao final')
+    args = parser.parse_args()
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = args.database_url or Config.SQLALCHEMY_DATABASE_URI
+        SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': args.paralelos, 'max_overflow': 0}
+
+    app = create_app(BenchmarkConfig)
+
+    with app.app_context():
+        setor = Setor(nome='Benchmark Numeração')
+        db.session.add(setor)
+        db.session.flush()
+        colaborador = Colaborador(nome='Benchmark Numeração', email=f'benchmark-{int(time.time())}@localhost', setor_id=setor.id)
+        colaborador.senha_hash = '-'
+        db.session.add(colaborador)
+        db.session.commit()
+        setor_id, colaborador_id = setor.id, colaborador.id
+        total_inicial = Protocolo.query.count()
+
+    print(f"Protocolos existentes antes do teste: {total_inicial}")
+    print(f"{args.rodadas} rodada(s) de {args.por_rodada} criações com {args.paralelos} threads\n")
+
+    numeros = []
+    medianas = []
+    indice = 0
+    with ThreadPoolExecutor(max_workers=args.paralelos) as executor:
+        for rodada in range(1, args.rodadas + 1):
+            futuros = []
+            for _ in range(args.por_rodada):
+                indice += 1
+                futuros.append(executor.submit(criar_protocolo_benchmark, app, setor_id, colaborador_id, indice))
+            resultados = [f.result() for f in futuros]
+            latencias = sorted(r[1] * 1000 for r in resultados)
+            numeros.extend(r[0] for r in resultados)
+            p95 = latencias[int(len(latencias) * 0.95) - 1]
+            medianas.append(statistics.median(latencias))
+            print(f"Rodada {rodada}: p50={medianas[-1]:.1f}ms  p95={p95:.1f}ms  max={latencias[-1]:.1f}ms")
+            if rodada == 1 and args.semear:
+                print(f"Inserindo {args.semear} protocolos antes da próxima rodada...")
+                semear_protocolos(app, setor_id, colaborador_id, args.semear)
+
+    duplicados = len(numeros) - len(set(numeros))
+    print(f"\nNúmeros alocados: {len(numeros)}  duplicados: {duplicados}")
+    pior_fator = max(mediana / medianas[0] for mediana in medianas[1:]) if len(medianas) > 1 and medianas[0] else 1.0
+    print(f"Maior p50 em relação à 1ª rodada: {pior_fator:.2f}x (limite {args.fator_maximo:.2f}x)")
+
+    with app.app_context():
+        if not args.manter:
+            Protocolo.query.filter(Protocolo.criado_por_id == colaborador_id).delete()
+            Colaborador.query.filter_by(id=colaborador_id).delete()
+            Setor.query.filter_by(id=setor_id).delete()
+            db.session.commit()
+
+    if duplicados:
+        print("❌ FALHA! Foram gerados números de protocolo repetidos.")
+        raise SystemExit(1)
+    if pior_fator > args.fator_maximo:
+        print("❌ FALHA! A latência da alocação cresceu junto com a tabela de protocolos.")
+        raise SystemExit(1)
+    print("✅ SUCESSO! Nenhum número de protocolo repetido e latência estável.")
+
+
+if __name__ == '__main__':
+    main()
@@ -12,6 +12,21 @@ class Config:
     # --- CONFIGURAÇÕES DE UPLOAD ---
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads/')
     ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'doc', 'docx', 'xls', 'xlsx'}
+    # Armazenamento por conteúdo (SHA-256) dos anexos; `flask anexos migrar` move os arquivos antigos para cá
+    ANEXOS_ARMAZENAMENTO_DIR = os.environ.get('ANEXOS_ARMAZENAMENTO_DIR') or os.path.join(UPLOAD_FOLDER, 'conteudo')
+    # '' (o Flask envia o arquivo), 'x-sendfile' (Apache mod_xsendfile / IIS com módulo equivalente)
+    # ou 'x-accel-redirect' (nginx, com uma location internal apontando para UPLOAD_FOLDER em ANEXOS_OFFLOAD_PREFIXO
+    # e outra para ANEXOS_ARMAZENAMENTO_DIR em ANEXOS_OFFLOAD_PREFIXO_ARMAZENAMENTO; o padrão serve o armazenamento dentro de uploads/)
+    ANEXOS_DOWNLOAD_OFFLOAD = os.environ.get('ANEXOS_DOWNLOAD_OFFLOAD', '')
+    ANEXOS_OFFLOAD_PREFIXO = os.environ.get('ANEXOS_OFFLOAD_PREFIXO', '/_uploads/')
+    ANEXOS_OFFLOAD_PREFIXO_ARMAZENAMENTO = os.environ.get('ANEXOS_OFFLOAD_PREFIXO_ARMAZENAMENTO', '/_uploads/conteudo/')
+    # Threads por processo que geram as miniaturas/prévias dos anexos após o upload
+    PREVIAS_WORKERS = int(os.environ.get('PREVIAS_WORKERS') or 2)
+    # Limites em bytes: por arquivo e pela soma dos anexos de um envio
+    ANEXO_TAMANHO_MAXIMO = int(os.environ.get('ANEXO_TAMANHO_MAXIMO') or 25 * 1024 * 1024)
+    ANEXOS_TAMANHO_MAXIMO_ENVIO = int(os.environ.get('ANEXOS_TAMANHO_MAXIMO_ENVIO') or 100 * 1024 * 1024)
+    # O Werkzeug recusa (413) requisições maiores que isso antes mesmo de ler o corpo; folga para os campos do formulário
+    MAX_CONTENT_LENGTH = ANEXOS_TAMANHO_MAXIMO_ENVIO + 1024 * 1024
 
     # --- CONFIGURAÇÕES DO BANCO DE DADOS PRINCIPAL ---
     DB_SERVER = os.environ.get('DB_SERVER')
@@ -35,6 +50,36 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Segundos que o usuário logado (perfil, permissões e setor) fica em cache entre requests
+    IDENTIDADE_CACHE_TTL = int(os.environ.get('IDENTIDADE_CACHE_TTL') or 30)
+
+    # --- CONFIGURAÇÕES DO DASHBOARD ---
+    # 'offset' (páginas numeradas) ou 'cursor' (paginação por keyset, sem OFFSET/COUNT a cada página)
+    DASHBOARD_PAGINACAO = os.environ.get('DASHBOARD_PAGINACAO', 'offset')
+    # Segundos que o total de protocolos fica em cache no modo 'cursor' (0 desliga a contagem)
+    DASHBOARD_CONTAGEM_TTL = int(os.environ.get('DASHBOARD_CONTAGEM_TTL') or 60)
+    # 'termos' (índice invertido próprio, portável) ou 'fulltext' (catálogo Full-Text do SQL Server)
+    BUSCA_BACKEND = os.environ.get('BUSCA_BACKEND', 'termos')
+
+    # --- CACHE DAS APIS DE RELATÓRIOS ---
+    # 'memoria' (LRU por processo) ou 'arquivos' (diretório compartilhado entre processos)
+    RESPOSTAS_CACHE_BACKEND = os.environ.get('RESPOSTAS_CACHE_BACKEND', 'memoria')
+    RESPOSTAS_CACHE_DIR = os.environ.get('RESPOSTAS_CACHE_DIR') or os.path.join(basedir, 'cache', 'respostas')
+    RESPOSTAS_CACHE_MAX_ITENS = int(os.environ.get('RESPOSTAS_CACHE_MAX_ITENS') or 256)
+
+    # --- CACHE DOS PDFS DE PROTOCOLO ---
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR') or os.path.join(basedir, 'cache', 'pdf')
+    PDF_CACHE_MAX_MB = int(os.environ.get('PDF_CACHE_MAX_MB') or 500)
+    # Renderização em processos separados (o WeasyPrint segura a CPU e o GIL); cada job é encerrado após PDF_TIMEOUT segundos
+    PDF_WORKERS = int(os.environ.get('PDF_WORKERS') or 2)
+    PDF_TIMEOUT = int(os.environ.get('PDF_TIMEOUT') or 120)
+    # Exportação em lote (/exportar/pdf): máximo de protocolos por ZIP e de PDFs renderizando ao mesmo tempo
+    EXPORTACAO_PDF_LIMITE = int(os.environ.get('EXPORTACAO_PDF_LIMITE') or 2000)
+    EXPORTACAO_PDF_JANELA = int(os.environ.get('EXPORTACAO_PDF_JANELA') or 8)
+    # Exportações em planilha: linhas lidas do banco por vez e tamanho do arquivo gerado que fica em memória
+    EXPORTACAO_LOTE = int(os.environ.get('EXPORTACAO_LOTE') or 1000)
+    EXPORTACAO_SPOOL_MB = int(os.environ.get('EXPORTACAO_SPOOL_MB') or 8)
+
     # --- CONFIGURAÇÕES DE EMAIL ---
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
@@ -42,6 +87,18 @@ class Config:
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
 
+    # --- FILA DE SAÍDA DE EMAILS (flask outbox run) ---
+    # Com o worker embutido, cada processo web também envia a fila; desligue se rodar `flask outbox run` à parte
+    OUTBOX_WORKER_EMBUTIDO = os.environ.get('OUTBOX_WORKER_EMBUTIDO', '1') == '1'
+    OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS') or 2)
+    OUTBOX_LOTE = int(os.environ.get('OUTBOX_LOTE') or 50)
+    OUTBOX_INTERVALO = int(os.environ.get('OUTBOX_INTERVALO') or 10)
+    OUTBOX_MAX_TENTATIVAS = int(os.environ.get('OUTBOX_MAX_TENTATIVAS') or 6)
+    OUTBOX_BACKOFF_BASE = int(os.environ.get('OUTBOX_BACKOFF_BASE') or 60)
+    OUTBOX_BACKOFF_MAXIMO = int(os.environ.get('OUTBOX_BACKOFF_MAXIMO') or 3600)
+    # Tempo até um email reservado por um worker que morreu voltar para a fila
+    OUTBOX_RESERVA_SEGUNDOS = int(os.environ.get('OUTBOX_RESERVA_SEGUNDOS') or 300)
+
     # --- CONFIGURAÇÕES DO BANCO DE DADOS EXTERNO (FORNECEDORES) --- <--- MOVER PARA DENTRO DA CLASSE
     EXT_DB_SERVER = '172.16.1.223'
     EXT_DB_NAME = 'P12_BI'  # <--- IMPORTANTE: Substitua pelo nome correto!
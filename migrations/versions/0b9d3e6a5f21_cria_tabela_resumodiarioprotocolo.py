@@ -0,0 +1,42 @@
+"""Cria tabela ResumoDiarioProtocolo para a série temporal de relatórios
+
+Revision ID: 0b9d3e6a5f21
+Revises: f4a7c2e19b63
+Create Date: 2026-10-18 14:22:47.530916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b9d3e6a5f21'
+down_revision = 'f4a7c2e19b63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ResumoDiarioProtocolo',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dia', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('setor_id', sa.Integer(), nullable=False),
+    sa.Column('modelo_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['setor_id'], ['Setor.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('dia', 'status', 'setor_id', 'modelo_id', name='uq_ResumoDiarioProtocolo_chave')
+    )
+
+    # Carga inicial a partir dos protocolos existentes (também pode ser refeita com `flask contadores backfill-resumo`)
+    op.execute(
+        "INSERT INTO ResumoDiarioProtocolo (dia, status, setor_id, modelo_id, total) "
+        "SELECT CAST(data_criacao AS DATE), status, setor_destinatario_id, COALESCE(modelo_usado_id, 0), COUNT(*) "
+        "FROM Protocolo "
+        "GROUP BY CAST(data_criacao AS DATE), status, setor_destinatario_id, COALESCE(modelo_usado_id, 0)"
+    )
+
+
+def downgrade():
+    op.drop_table('ResumoDiarioProtocolo')
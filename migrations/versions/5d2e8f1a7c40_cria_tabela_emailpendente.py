@@ -0,0 +1,42 @@
+"""Cria tabela EmailPendente (fila de saída de emails)
+
+Revision ID: 5d2e8f1a7c40
+Revises: 0b9d3e6a5f21
+Create Date: 2026-10-18 15:03:12.804211
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8f1a7c40'
+down_revision = '0b9d3e6a5f21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('EmailPendente',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('assunto', sa.String(length=255), nullable=False),
+    sa.Column('destinatarios', sa.Text(), nullable=False),
+    sa.Column('corpo_html', sa.Text(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('tentativas', sa.Integer(), nullable=False),
+    sa.Column('proxima_tentativa', mssql.DATETIME2(), nullable=False),
+    sa.Column('reservado_por', sa.String(length=64), nullable=True),
+    sa.Column('ultimo_erro', sa.Text(), nullable=True),
+    sa.Column('data_criacao', mssql.DATETIME2(), server_default=sa.text('(getdate())'), nullable=False),
+    sa.Column('data_envio', mssql.DATETIME2(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('EmailPendente', schema=None) as batch_op:
+        batch_op.create_index('ix_EmailPendente_status_proxima', ['status', 'proxima_tentativa'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('EmailPendente', schema=None) as batch_op:
+        batch_op.drop_index('ix_EmailPendente_status_proxima')
+
+    op.drop_table('EmailPendente')
@@ -0,0 +1,45 @@
+"""Adiciona intervalo_resumo ao Colaborador e tabela NotificacaoPendente
+
+Revision ID: 8a4f0c3b2d96
+Revises: 5d2e8f1a7c40
+Create Date: 2026-10-18 15:41:38.261907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import mssql
+
+# revision identifiers, used by Alembic.
+revision = '8a4f0c3b2d96'
+down_revision = '5d2e8f1a7c40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Colaborador', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('intervalo_resumo', sa.Integer(), server_default=sa.text('0'), nullable=False))
+
+    op.create_table('NotificacaoPendente',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('colaborador_id', sa.Integer(), nullable=False),
+    sa.Column('protocolo_id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=30), nullable=False),
+    sa.Column('dados', sa.Text(), nullable=False),
+    sa.Column('data_criacao', mssql.DATETIME2(), nullable=False),
+    sa.ForeignKeyConstraint(['colaborador_id'], ['Colaborador.id'], ),
+    sa.ForeignKeyConstraint(['protocolo_id'], ['Protocolo.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('NotificacaoPendente', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_NotificacaoPendente_colaborador_id'), ['colaborador_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('NotificacaoPendente', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_NotificacaoPendente_colaborador_id'))
+
+    op.drop_table('NotificacaoPendente')
+
+    with op.batch_alter_table('Colaborador', schema=None) as batch_op:
+        batch_op.drop_column('intervalo_resumo')
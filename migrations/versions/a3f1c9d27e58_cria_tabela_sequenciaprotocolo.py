@@ -0,0 +1,45 @@
+"""Cria tabela SequenciaProtocolo para numeração dos protocolos
+
+Revision ID: a3f1c9d27e58
+Revises: 4297a21cba88
+Create Date: 2026-10-18 09:12:40.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3f1c9d27e58'
+down_revision = '4297a21cba88'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('SequenciaProtocolo',
+    sa.Column('ano', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('ultimo_numero', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('ano')
+    )
+
+    # Inicializa os contadores com o maior número já emitido em cada ano
+    conn = op.get_bind()
+    ultimos = conn.execute(sa.text(
+        "SELECT LEFT(numero_protocolo, 4) AS ano, MAX(numero_protocolo) AS ultimo "
+        "FROM Protocolo WHERE numero_protocolo LIKE '[0-9][0-9][0-9][0-9]-%' "
+        "GROUP BY LEFT(numero_protocolo, 4)"
+    )).fetchall()
+    for linha in ultimos:
+        try:
+            sequencial = int(linha.ultimo.split('-')[1])
+        except (IndexError, ValueError):
+            continue
+        conn.execute(
+            sa.text("INSERT INTO SequenciaProtocolo (ano, ultimo_numero) VALUES (:ano, :ultimo)"),
+            {'ano': int(linha.ano), 'ultimo': sequencial}
+        )
+
+
+def downgrade():
+    op.drop_table('SequenciaProtocolo')
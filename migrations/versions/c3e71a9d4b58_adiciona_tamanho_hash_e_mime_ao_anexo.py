@@ -0,0 +1,30 @@
+"""Adiciona tamanho, sha256 e mime_type ao Anexo
+
+Revision ID: c3e71a9d4b58
+Revises: 8a4f0c3b2d96
+Create Date: 2026-10-18 16:12:09.447105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e71a9d4b58'
+down_revision = '8a4f0c3b2d96'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Anexo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('tamanho', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('sha256', sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column('mime_type', sa.String(length=100), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('Anexo', schema=None) as batch_op:
+        batch_op.drop_column('mime_type')
+        batch_op.drop_column('sha256')
+        batch_op.drop_column('tamanho')
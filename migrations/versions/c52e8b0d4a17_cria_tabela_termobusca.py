@@ -0,0 +1,87 @@
+"""Cria tabela TermoBusca (índice invertido da busca de protocolos)
+
+Revision ID: c52e8b0d4a17
+Revises: a3f1c9d27e58
+Create Date: 2026-10-18 10:02:11.540273
+
+O upgrade já indexa os protocolos existentes com uma cópia da tokenização desta revisão
+(a migração não depende de app.busca); `flask busca reindexar` reconstrói o índice quando
+for preciso (ex.: depois de mudar a tokenização).
+"""
+import re
+import unicodedata
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52e8b0d4a17'
+down_revision = 'a3f1c9d27e58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('TermoBusca',
+    sa.Column('termo', sa.String(length=64), nullable=False),
+    sa.Column('protocolo_id', sa.Integer(), nullable=False),
+    sa.Column('peso', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['protocolo_id'], ['Protocolo.id'], ),
+    sa.PrimaryKeyConstraint('termo', 'protocolo_id')
+    )
+    with op.batch_alter_table('TermoBusca', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_TermoBusca_protocolo_id'), ['protocolo_id'], unique=False)
+
+    indexar_protocolos_existentes()
+
+
+# Tokenização de app/busca.py como estava nesta revisão
+PESOS = {'numero_protocolo': 5, 'assunto': 3, 'descricao': 1}
+TAMANHO_MINIMO = 2
+
+
+def tokenizar(texto):
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(c for c in texto if not unicodedata.combining(c)).lower()
+    return [t[:64] for t in re.findall(r'\w+', texto) if len(t) >= TAMANHO_MINIMO]
+
+
+def termos_do_protocolo(protocolo):
+    termos = {}
+    for campo, peso in PESOS.items():
+        for termo in tokenizar(getattr(protocolo, campo)):
+            termos[termo] = termos.get(termo, 0) + peso
+    partes = (protocolo.numero_protocolo or '').split('-')
+    if len(partes) == 2 and partes[1].isdigit():
+        sequencial = str(int(partes[1]))
+        termos[sequencial] = termos.get(sequencial, 0) + PESOS['numero_protocolo']
+    return termos
+
+
+def indexar_protocolos_existentes(lote=1000):
+    """Sem isto a busca do dashboard não acharia nenhum protocolo antigo até alguém rodar o reindexar."""
+    conn = op.get_bind()
+    protocolo = sa.table('Protocolo',
+        sa.column('id', sa.Integer), sa.column('numero_protocolo', sa.String),
+        sa.column('assunto', sa.String), sa.column('descricao', sa.Text))
+    termo_busca = sa.table('TermoBusca',
+        sa.column('termo', sa.String), sa.column('protocolo_id', sa.Integer), sa.column('peso', sa.Integer))
+    ultimo_id = 0
+    while True:
+        protocolos = conn.execute(
+            sa.select(protocolo).where(protocolo.c.id > ultimo_id).order_by(protocolo.c.id).limit(lote)
+        ).all()
+        if not protocolos:
+            break
+        linhas = [{'termo': termo, 'protocolo_id': p.id, 'peso': peso}
+                  for p in protocolos for termo, peso in termos_do_protocolo(p).items()]
+        if linhas:
+            conn.execute(termo_busca.insert(), linhas)
+        ultimo_id = protocolos[-1].id
+
+
+def downgrade():
+    with op.batch_alter_table('TermoBusca', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_TermoBusca_protocolo_id'))
+
+    op.drop_table('TermoBusca')
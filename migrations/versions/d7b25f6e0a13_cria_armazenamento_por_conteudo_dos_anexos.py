@@ -0,0 +1,36 @@
+"""Cria tabela ConteudoAnexo e índice de Anexo.protocolo_id
+
+Revision ID: d7b25f6e0a13
+Revises: c3e71a9d4b58
+Create Date: 2026-10-18 16:48:55.320174
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7b25f6e0a13'
+down_revision = 'c3e71a9d4b58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ConteudoAnexo',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('tamanho', sa.BigInteger(), nullable=False),
+    sa.Column('referencias', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    with op.batch_alter_table('Anexo', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_Anexo_protocolo_id'), ['protocolo_id'], unique=False)
+
+    # Os arquivos existentes entram no armazenamento com `flask anexos migrar`
+
+
+def downgrade():
+    with op.batch_alter_table('Anexo', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Anexo_protocolo_id'))
+
+    op.drop_table('ConteudoAnexo')
@@ -0,0 +1,51 @@
+"""Adiciona índices compostos em Protocolo e Historico
+
+Revision ID: e81d4b6f9c30
+Revises: c52e8b0d4a17
+Create Date: 2026-10-18 11:24:37.901642
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81d4b6f9c30'
+down_revision = 'c52e8b0d4a17'
+branch_labels = None
+depends_on = None
+
+INDICES_PROTOCOLO = [
+    ('ix_Protocolo_data_criacao_id', ['data_criacao', 'id']),
+    ('ix_Protocolo_status_data_criacao', ['status', 'data_criacao']),
+    ('ix_Protocolo_setor_status_data', ['setor_destinatario_id', 'status', 'data_criacao']),
+    ('ix_Protocolo_criado_por_status_data', ['criado_por_id', 'status', 'data_criacao']),
+    ('ix_Protocolo_colab_dest_status_data', ['colaborador_destinatario_id', 'status', 'data_criacao']),
+    ('ix_Protocolo_modelo_data_criacao', ['modelo_usado_id', 'data_criacao']),
+]
+
+INDICES_HISTORICO = [
+    ('ix_Historico_protocolo_data', ['protocolo_id', 'data_ocorrencia']),
+    ('ix_Historico_data_ocorrencia', ['data_ocorrencia']),
+    ('ix_Historico_colaborador_data', ['colaborador_id', 'data_ocorrencia']),
+]
+
+
+def upgrade():
+    with op.batch_alter_table('Protocolo', schema=None) as batch_op:
+        for nome, colunas in INDICES_PROTOCOLO:
+            batch_op.create_index(nome, colunas, unique=False)
+
+    with op.batch_alter_table('Historico', schema=None) as batch_op:
+        for nome, colunas in INDICES_HISTORICO:
+            batch_op.create_index(nome, colunas, unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Historico', schema=None) as batch_op:
+        for nome, _ in reversed(INDICES_HISTORICO):
+            batch_op.drop_index(nome)
+
+    with op.batch_alter_table('Protocolo', schema=None) as batch_op:
+        for nome, _ in reversed(INDICES_PROTOCOLO):
+            batch_op.drop_index(nome)
@@ -0,0 +1,40 @@
+"""Cria tabela ContadorProtocolo para os gráficos de relatórios
+
+Revision ID: f4a7c2e19b63
+Revises: e81d4b6f9c30
+Create Date: 2026-10-18 13:40:05.117482
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a7c2e19b63'
+down_revision = 'e81d4b6f9c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ContadorProtocolo',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=50), nullable=False),
+    sa.Column('setor_id', sa.Integer(), nullable=False),
+    sa.Column('modelo_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['setor_id'], ['Setor.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('status', 'setor_id', 'modelo_id', name='uq_ContadorProtocolo_chave')
+    )
+
+    # Carga inicial a partir dos protocolos existentes
+    op.execute(
+        "INSERT INTO ContadorProtocolo (status, setor_id, modelo_id, total) "
+        "SELECT status, setor_destinatario_id, COALESCE(modelo_usado_id, 0), COUNT(*) "
+        "FROM Protocolo GROUP BY status, setor_destinatario_id, COALESCE(modelo_usado_id, 0)"
+    )
+
+
+def downgrade():
+    op.drop_table('ContadorProtocolo')
@@ -0,0 +1,35 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import event
+from sqlalchemy.dialects.mssql import DATETIME2
+from sqlalchemy.ext.compiler import compiles
+from config import Config
+from app import create_app, db
+
+# Os modelos usam tipos e defaults do SQL Server; no SQLite dos testes eles viram equivalentes
+@compiles(DATETIME2, 'sqlite')
+def _datetime2_no_sqlite(tipo, compilador, **kw):
+    return 'DATETIME'
+
+class ConfigTeste(Config):
+    TESTING = True
+    SECRET_KEY = 'teste'
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    OUTBOX_WORKER_EMBUTIDO = False
+
+@pytest.fixture
+def app(tmp_path):
+    ConfigTeste.UPLOAD_FOLDER = str(tmp_path / 'uploads')
+    ConfigTeste.ANEXOS_ARMAZENAMENTO_DIR = str(tmp_path / 'uploads' / 'conteudo')
+    ConfigTeste.PDF_CACHE_DIR = str(tmp_path / 'pdf')
+    app = create_app(ConfigTeste)
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def _getdate(conexao, registro):
+            conexao.create_function('getdate', 0, lambda: datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f'))
+        db.engine.dispose()
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
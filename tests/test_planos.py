@@ -0,0 +1,38 @@
+from app import db
+from app.busca import indexar_protocolo
+from app.contadores import registrar_criacao
+from app.models import Colaborador, Historico, Perfil, Permissao, Protocolo, Setor
+from app.planos import verificar_planos
+
+def _popular():
+    admin = Perfil(nome='Super Admin', permissoes=[Permissao(nome='acessar_painel_admin')])
+    ti, rh = Setor(nome='TI'), Setor(nome='RH')
+    db.session.add_all([admin, ti, rh])
+    db.session.flush()
+    administrador = Colaborador(nome='Admin', email='admin@teste', setor_id=ti.id, perfil_id=admin.id)
+    colaborador = Colaborador(nome='Colaborador', email='colaborador@teste', setor_id=rh.id)
+    for usuario in (administrador, colaborador):
+        usuario.senha = 'senha'
+    db.session.add_all([administrador, colaborador])
+    db.session.flush()
+
+    for n, status in enumerate(['Aberto', 'Em Análise', 'Pendente', 'Finalizado', 'Rascunho'] * 4):
+        protocolo = Protocolo(
+            numero_protocolo=f'2025-{n + 1:06d}', assunto=f'Protocolo de teste {n}', descricao='Nota fiscal',
+            criado_por_id=(administrador, colaborador)[n % 2].id, setor_destinatario_id=(ti, rh)[n % 2].id,
+            status=status, dados_preenchidos=[]
+        )
+        db.session.add(protocolo)
+        db.session.add(Historico(descricao='Criado.', protocolo=protocolo, colaborador_id=administrador.id))
+        indexar_protocolo(protocolo)
+        registrar_criacao(protocolo)
+    db.session.commit()
+    return colaborador, administrador
+
+def test_consultas_das_rotas_usam_indices(app):
+    colaborador, administrador = _popular()
+
+    resultados = verificar_planos(colaborador, administrador)
+
+    assert resultados
+    assert [(nome, problemas) for nome, problemas in resultados if problemas] == []